@@ -0,0 +1,219 @@
+"""Measure formula reference rewriting throughput of create_xlsx in cells/sec."""
+
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from create_xlsx import adjust_formula_references, FormulaRewriter
+
+FORMULAS = [
+    "=B[0]+C[0]+D[0]",
+    "=SUM(B[0]:E[0])",
+    "=T1.B[0]+T1.B[1]+T1.B[2]",
+    "=T1.SUM(C[0]:F[2])",
+    "=T2.AVERAGE(B[0]:B[9])*C[0]",
+    "=IF(B[0]>0,C[0]/B[0],0)",
+]
+
+
+def baseline_adjust_formula_references(formula, current_excel_row, table_positions=None):
+    """Previous implementation (five re.sub passes per cell), kept as the baseline of the benchmark"""
+    if not formula.startswith('='):
+        return formula
+
+    if table_positions is None:
+        table_positions = {}
+
+    # First handle table-based references like T1.B[1], T2.SUM(C[0]:F[0])
+    table_pattern = r'T(\d+)\.([A-Z]+)\[([+-]?\d+)\]'
+
+    def replace_table_reference(match):
+        table_num = int(match.group(1))
+        column = match.group(2)
+        offset = int(match.group(3))
+
+        # Get the starting row of the specified table
+        table_key = f"T{table_num}"
+        if table_key in table_positions:
+            table_start_row = table_positions[table_key]
+            # Add 1 to skip header row, then add offset
+            actual_row = table_start_row + 1 + offset
+            return f"{column}{actual_row}"
+        else:
+            # Fallback to current table if table not found
+            actual_row = current_excel_row + offset
+            return f"{column}{actual_row}"
+
+    # Replace table-based cell references
+    adjusted_formula = re.sub(table_pattern, replace_table_reference, formula)
+
+    # Handle table-based range references like T1.B[0]:T1.E[0]
+    table_range_pattern = r'T(\d+)\.([A-Z]+)\[([+-]?\d+)\]:T(\d+)\.([A-Z]+)\[([+-]?\d+)\]'
+
+    def replace_table_range(match):
+        start_table_num = int(match.group(1))
+        start_col = match.group(2)
+        start_offset = int(match.group(3))
+        end_table_num = int(match.group(4))
+        end_col = match.group(5)
+        end_offset = int(match.group(6))
+
+        # Get starting rows for both tables
+        start_table_key = f"T{start_table_num}"
+        end_table_key = f"T{end_table_num}"
+
+        if start_table_key in table_positions:
+            start_table_row = table_positions[start_table_key]
+            start_row = start_table_row + 1 + start_offset
+        else:
+            start_row = current_excel_row + start_offset
+
+        if end_table_key in table_positions:
+            end_table_row = table_positions[end_table_key]
+            end_row = end_table_row + 1 + end_offset
+        else:
+            end_row = current_excel_row + end_offset
+
+        return f"{start_col}{start_row}:{end_col}{end_row}"
+
+    adjusted_formula = re.sub(table_range_pattern, replace_table_range, adjusted_formula)
+
+    # Handle simplified table range references like T1.SUM(B[0]:E[0])
+    table_func_pattern = r'T(\d+)\.(SUM|AVERAGE|MAX|MIN)\(([A-Z]+)\[([+-]?\d+)\]:([A-Z]+)\[([+-]?\d+)\]\)'
+
+    def replace_table_function(match):
+        table_num = int(match.group(1))
+        func_name = match.group(2)
+        start_col = match.group(3)
+        start_offset = int(match.group(4))
+        end_col = match.group(5)
+        end_offset = int(match.group(6))
+
+        table_key = f"T{table_num}"
+        if table_key in table_positions:
+            table_start_row = table_positions[table_key]
+            start_row = table_start_row + 1 + start_offset
+            end_row = table_start_row + 1 + end_offset
+        else:
+            start_row = current_excel_row + start_offset
+            end_row = current_excel_row + end_offset
+
+        return f"{func_name}({start_col}{start_row}:{end_col}{end_row})"
+
+    adjusted_formula = re.sub(table_func_pattern, replace_table_function, adjusted_formula)
+
+    # Find the current table's start row for relative references
+    current_table_start = None
+    for table_key, table_start_row in table_positions.items():
+        # Check if current_excel_row falls within this table's range
+        # We need to find which table contains the current row
+        if table_start_row <= current_excel_row:
+            current_table_start = table_start_row
+
+    # Finally, handle regular row-relative references [offset] for current table
+    pattern = r'([A-Z]+)\[([+-]?\d+)\]'
+
+    def replace_reference(match):
+        column = match.group(1)
+        offset = int(match.group(2))
+
+        # Calculate from the start of the current table, not the current row
+        if current_table_start is not None:
+            actual_row = current_table_start + 1 + offset  # +1 to skip header
+        else:
+            # Fallback to old behavior if we can't determine table start
+            actual_row = current_excel_row + offset
+
+        return f"{column}{actual_row}"
+
+    # Replace all remaining row-relative references
+    adjusted_formula = re.sub(pattern, replace_reference, adjusted_formula)
+
+    # Handle regular range references like B[0]:E[0] (within current table)
+    range_pattern = r'([A-Z]+)\[([+-]?\d+)\]:([A-Z]+)\[([+-]?\d+)\]'
+
+    def replace_range(match):
+        start_col = match.group(1)
+        start_offset = int(match.group(2))
+        end_col = match.group(3)
+        end_offset = int(match.group(4))
+
+        # Calculate from the start of the current table, not the current row
+        if current_table_start is not None:
+            start_row = current_table_start + 1 + start_offset  # +1 to skip header
+            end_row = current_table_start + 1 + end_offset
+        else:
+            # Fallback to old behavior if we can't determine table start
+            start_row = current_excel_row + start_offset
+            end_row = current_excel_row + end_offset
+
+        return f"{start_col}{start_row}:{end_col}{end_row}"
+
+    adjusted_formula = re.sub(range_pattern, replace_range, adjusted_formula)
+
+    return adjusted_formula
+
+
+def workload(tables, rows):
+    """Returns table positions and (formula, row) pairs of formula cells"""
+    table_positions = {}
+    cells = []
+    row = 1
+    for table in range(1, tables + 1):
+        table_positions[f"T{table}"] = row
+        for data_row in range(row + 1, row + 1 + rows):
+            for formula in FORMULAS:
+                cells.append((formula, data_row))
+        row += rows + 3
+    return table_positions, cells
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tables", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    table_positions, cells = workload(args.tables, args.rows)
+
+    def baseline():
+        for formula, row in cells:
+            baseline_adjust_formula_references(formula, row, table_positions)
+
+    def per_cell():
+        # Standalone function, nothing is shared between cells
+        for formula, row in cells:
+            adjust_formula_references(formula, row, table_positions)
+
+    def per_workbook():
+        # One rewriter per workbook, as used by markdown_to_excel
+        rewriter = FormulaRewriter(table_positions)
+        for formula, row in cells:
+            rewriter.rewrite(formula, row)
+
+    # Both implementations must give the same formulas
+    rewriter = FormulaRewriter(table_positions)
+    for formula, row in cells:
+        expected = baseline_adjust_formula_references(formula, row, table_positions)
+        if rewriter.rewrite(formula, row) != expected:
+            raise SystemExit(f"Mismatch for {formula} in row {row}: {rewriter.rewrite(formula, row)} != {expected}")
+
+    for label, run in (("re.sub passes (baseline)", baseline), ("adjust_formula_references", per_cell),
+                       ("FormulaRewriter", per_workbook)):
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        print(f"{label:<26} {len(cells)} formula cells in {best:.3f} s: {len(cells) / best:,.0f} cells/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Measure inline markdown formatting of Word paragraphs on long legal-contract paragraphs."""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+# Clauses of roughly 250 characters, repeated to build long paragraphs
+CLAUSES = {
+    "plain": "The Seller shall deliver the Goods specified in Annex 1 to the Buyer within thirty (30) "
+             "days, unless agreed otherwise in writing and subject to Article 5 of this Agreement. ",
+    "formatted": "The **Seller** shall deliver the *Goods* specified in `Annex 1` to the **Buyer** within "
+                 "thirty (30) days, see [the terms](https://example.com/terms), unless ***agreed*** otherwise. ",
+    "escaped": "The Seller shall deliver the Goods \\*as is\\* within thirty (30) days, subject to "
+               "Art\\. 5 \\[Force Majeure\\], Art\\. 6 \\[Liability\\] and Art\\. 7 \\[Termination\\]. ",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--paragraphs", type=int, default=200)
+    parser.add_argument("--clauses", type=int, default=40, help="clauses per paragraph")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from docx import Document
+    from create_docx import parse_inline_formatting
+
+    for label, clause in CLAUSES.items():
+        paragraph_text = clause * args.clauses
+
+        best = None
+        for _ in range(args.repeat):
+            doc = Document()
+            start = time.perf_counter()
+            for _ in range(args.paragraphs):
+                parse_inline_formatting(paragraph_text, doc.add_paragraph())
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        megabytes = len(paragraph_text) * args.paragraphs / (1024 * 1024)
+        print(f"{label:<10} {args.paragraphs} paragraphs of {len(paragraph_text)} chars in {best:.3f} s: "
+              f"{best / args.paragraphs * 1000:.2f} ms/paragraph, {megabytes / best:.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Measure the shared markdown block tokenizer and both converters on ~1 MB of markdown."""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+def generate_markdown(size):
+    """Returns synthetic markdown of roughly given size in bytes"""
+    sections = []
+    total = 0
+    index = 0
+    while total < size:
+        section = "\n".join([
+            f"# Section {index}",
+            "",
+            f"Paragraph {index} with **bold**, *italic*, `code` and a [link](https://example.com/{index}).",
+            "Line with a hard break  ",
+            "continues here.",
+            "",
+            "1. Article",
+            "   1. First provision",
+            "   2. Second provision",
+            "      - nested bullet",
+            "2. Next article",
+            "",
+            "> Quoted text",
+            "",
+            "| Item | Q1 | Q2 | Total |",
+            "|---|---|---|---|",
+            *(f"| Row {row} | {row * 10} | 0.{row + 1} | =B[{row}]+C[{row}] |" for row in range(8)),
+            "",
+            "---",
+            "",
+        ])
+        sections.append(section)
+        total += len(section) + 1
+        index += 1
+    return "\n".join(sections)
+
+
+def best_of(repeat, func):
+    """Returns the shortest run time of func in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="markdown size in bytes")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    markdown = generate_markdown(args.size)
+    megabytes = len(markdown.encode("utf-8")) / (1024 * 1024)
+
+    from markdown_blocks import iter_blocks
+    from create_docx import build_word
+    from create_xlsx import build_excel
+
+    lines = markdown.split("\n")
+    blocks = sum(1 for _ in iter_blocks(lines))
+    elapsed = best_of(args.repeat, lambda: sum(1 for _ in iter_blocks(markdown.split("\n"))))
+    print(f"iter_blocks    {megabytes:.2f} MB, {blocks} blocks in {elapsed:.3f} s: {megabytes / elapsed:.1f} MB/s")
+
+    for label, build in (("build_word", build_word), ("build_excel", build_excel)):
+        elapsed = best_of(1, lambda: build(markdown))
+        print(f"{label:<14} {megabytes:.2f} MB in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
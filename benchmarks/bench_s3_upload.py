@@ -0,0 +1,96 @@
+"""Compare per-upload latency of a fresh S3 client per call against the shared client.
+
+Runs fully offline against a local S3 stand-in. Without S3_ENDPOINT_URL set, a moto
+server is started in-process (pip install "moto[server]"). To use MinIO instead:
+
+    S3_ENDPOINT_URL=http://localhost:9000 S3_BUCKET=bench AWS_ACCESS_KEY=minioadmin \\
+    AWS_SECRET_ACCESS_KEY=minioadmin python benchmarks/bench_s3_upload.py
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+def start_moto_server():
+    """Starts in-process moto server and returns its endpoint URL"""
+    import logging
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f"http://{host}:{port}"
+
+
+def measure(label, upload, payload, count):
+    """Runs upload count times and prints latency statistics"""
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        upload(io.BytesIO(payload))
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    print(f"{label:<16} mean {statistics.mean(latencies):7.2f} ms   "
+          f"p50 {latencies[len(latencies) // 2]:7.2f} ms   p99 {latencies[int(len(latencies) * 0.99) - 1]:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200, help="number of uploads per variant")
+    parser.add_argument("--size", type=int, default=30_000, help="document size in bytes")
+    args = parser.parse_args()
+
+    server = None
+    if not os.environ.get("S3_ENDPOINT_URL"):
+        server, endpoint = start_moto_server()
+        os.environ["S3_ENDPOINT_URL"] = endpoint
+        os.environ.setdefault("S3_BUCKET", "bench")
+        os.environ.setdefault("AWS_ACCESS_KEY", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ["UPLOAD_STRATEGY"] = "S3"
+
+    import boto3
+    import upload_file
+
+    client = upload_file.get_s3_client()
+    try:
+        client.create_bucket(Bucket=upload_file.S3_BUCKET)
+    except client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    print(f"S3 health check: {upload_file.s3_health_check()}")
+
+    payload = os.urandom(args.size)
+
+    def upload_with_fresh_client(file_object):
+        # Previous behaviour, a new client for every document
+        s3_client = boto3.client('s3', region_name=upload_file.AWS_REGION,
+                                 aws_access_key_id=upload_file.AWS_ACCESS_KEY,
+                                 aws_secret_access_key=upload_file.AWS_SECRET_ACCESS_KEY,
+                                 endpoint_url=upload_file.S3_ENDPOINT_URL)
+        s3_client.upload_fileobj(Fileobj=file_object, Bucket=upload_file.S3_BUCKET, Key="bench.docx")
+        s3_client.generate_presigned_url('get_object', Params={'Bucket': upload_file.S3_BUCKET, 'Key': "bench.docx"},
+                                         ExpiresIn=3600)
+
+    backend = upload_file.S3UploadBackend()
+
+    def upload_with_shared_client(file_object):
+        backend.upload(file_object, "bench.docx")
+
+    measure("fresh client", upload_with_fresh_client, payload, args.count)
+    measure("shared client", upload_with_shared_client, payload, args.count)
+
+    if server:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
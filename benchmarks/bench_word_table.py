@@ -0,0 +1,47 @@
+"""Measure building Word tables from markdown table data for 1k, 10k and 50k cells."""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+def table_data(rows, cols):
+    """Returns header and rows of cells, every fifth cell has inline formatting"""
+    data = [[f"Column {col}" for col in range(cols)]]
+    for row in range(rows - 1):
+        data.append([
+            f"**{row}.{col}** *net*" if (row + col) % 5 == 0 else f"Value {row}.{col}"
+            for col in range(cols)
+        ])
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--cells", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from docx import Document
+    from create_docx import add_table_to_doc
+
+    for cells in args.cells:
+        data = table_data(cells // args.cols, args.cols)
+
+        best = None
+        for _ in range(args.repeat):
+            doc = Document()
+            start = time.perf_counter()
+            add_table_to_doc(data, doc)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        print(f"{cells:>6} cells ({len(data)}x{args.cols}) in {best:.3f} s: {cells / best:,.0f} cells/sec")
+
+
+if __name__ == "__main__":
+    main()
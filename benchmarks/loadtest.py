@@ -0,0 +1,253 @@
+"""Load test of the MCP server over the streamable-http /mcp endpoint.
+
+Sends a weighted mix of the four document tools, either closed-loop (--concurrency
+clients each waiting for their previous call) or open-loop at a fixed rate (--rps, latency
+is measured from the scheduled send time, so a slow server is not hidden by a slower send
+rate). Reports throughput, latency percentiles and error rate per tool.
+
+With --spawn-server, the server (src/main.py) is started on port 8958 with the LOCAL
+upload strategy and a temporary output folder, or with --backend s3 against an
+in-process moto server (pip install "moto[server]"), so the test runs fully offline:
+
+    python benchmarks/loadtest.py --spawn-server --concurrency 16 --duration 30
+    python benchmarks/loadtest.py --url http://localhost:8958/mcp --rps 20 --mix pptx=1,docx=2,eml=4
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+import workloads
+
+SERVER_PORT = 8958
+
+TOOLS = {
+    "pptx": ("create_powerpoint_presentation", lambda seed: workloads.deck_slides(10, seed=seed)),
+    "docx": ("create_word_from_markdown", lambda seed: workloads.markdown_document(50, 50, seed=seed)),
+    "xlsx": ("create_excel_from_markdown", lambda seed: workloads.formula_sheet(3, 30, seed=seed)),
+    "eml": ("create_email_draft", lambda seed: workloads.email(seed)),
+}
+
+
+def parse_mix(value):
+    """Parses tool weights in the form 'pptx=1,docx=2'"""
+    mix = {}
+    for item in value.split(","):
+        tool, _, weight = item.partition("=")
+        if tool.strip() not in TOOLS:
+            raise argparse.ArgumentTypeError(f"unknown tool '{tool}', use {', '.join(TOOLS)}")
+        mix[tool.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values, percent):
+    """Returns nearest-rank percentile of the values"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+class LoadTest:
+    """Sends tool calls and collects (tool, latency, error) samples"""
+
+    def __init__(self, url, mix, unique, seed):
+        self.url = url
+        self.tools = list(mix)
+        self.weights = [mix[tool] for tool in self.tools]
+        self.unique = unique
+        self.rng = random.Random(seed)
+        self.counter = itertools.count()
+        self.samples = []
+
+    def next_call(self):
+        """Returns tool and arguments of the next call"""
+        tool = self.rng.choices(self.tools, self.weights)[0]
+        # Unique arguments, otherwise the server returns the cached documents
+        seed = next(self.counter) if self.unique else 0
+        name, make_arguments = TOOLS[tool]
+        return tool, name, make_arguments(seed)
+
+    async def call(self, client, started=None):
+        """Calls one tool and records its latency from started (default now)"""
+        tool, name, arguments = self.next_call()
+        started = started or time.perf_counter()
+        error = None
+        try:
+            result = await client.call_tool(name, arguments, raise_on_error=False)
+            text = result.content[0].text if result.content else ""
+            if result.is_error or text.startswith("Error") or "cannot be created" in text:
+                error = text[:200] or "empty result"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self.samples.append((tool, time.perf_counter() - started, error))
+
+    async def closed_loop(self, concurrency, duration):
+        """Each of concurrency clients sends its next call when the previous one is done"""
+        from fastmcp import Client
+
+        deadline = time.perf_counter() + duration
+
+        async def user():
+            async with Client(self.url) as client:
+                while time.perf_counter() < deadline:
+                    await self.call(client)
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+
+    async def open_loop(self, rps, duration, connections):
+        """Sends calls at a fixed rate regardless of responses, over a pool of client sessions"""
+        from fastmcp import Client
+
+        clients = [Client(self.url) for _ in range(connections)]
+        for client in clients:
+            await client.__aenter__()
+        try:
+            tasks = []
+            start = time.perf_counter()
+            for index in range(int(rps * duration)):
+                scheduled = start + index / rps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self.call(clients[index % connections], scheduled)))
+            await asyncio.gather(*tasks)
+        finally:
+            for client in clients:
+                await client.__aexit__(None, None, None)
+
+    def report(self, elapsed):
+        """Returns summary per tool and in total"""
+        summary = {}
+        for tool in self.tools + ["total"]:
+            samples = [sample for sample in self.samples if tool == "total" or sample[0] == tool]
+            if not samples:
+                continue
+            latencies = [latency * 1000 for _, latency, error in samples if error is None]
+            errors = sum(1 for _, _, error in samples if error is not None)
+            summary[tool] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": errors / len(samples),
+                "throughput_per_sec": len(latencies) / elapsed,
+                **({
+                    "p50_ms": percentile(latencies, 50),
+                    "p90_ms": percentile(latencies, 90),
+                    "p99_ms": percentile(latencies, 99),
+                    "max_ms": max(latencies),
+                } if latencies else {}),
+            }
+        return summary
+
+
+def wait_for_ready(port, timeout):
+    """Waits until the server has finished its warm-up and reports ready"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1):
+                return
+        except OSError:
+            # Not listening yet or 503 while warming up
+            time.sleep(0.2)
+    raise TimeoutError(f"Server on port {port} was not ready within {timeout} s")
+
+
+def start_server(backend, output_dir):
+    """Starts src/main.py with LOCAL or moto S3 upload, returns (process, moto server)"""
+    env = dict(os.environ)
+    moto_server = None
+    if backend == "s3":
+        import boto3
+        from bench_s3_upload import start_moto_server
+
+        moto_server, endpoint = start_moto_server()
+        env.update(UPLOAD_STRATEGY="S3", S3_ENDPOINT_URL=endpoint, S3_BUCKET="loadtest", AWS_REGION="us-east-1",
+                   AWS_ACCESS_KEY="testing", AWS_SECRET_ACCESS_KEY="testing")
+        boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1", aws_access_key_id="testing",
+                     aws_secret_access_key="testing").create_bucket(Bucket="loadtest")
+    else:
+        env.update(UPLOAD_STRATEGY="LOCAL", LOCAL_OUTPUT_DIR=output_dir)
+
+    src_dir = BENCHMARKS_DIR.parent / "src"
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=src_dir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_ready(SERVER_PORT, 60)
+    except TimeoutError:
+        process.kill()
+        raise
+    return process, moto_server
+
+
+def print_report(summary, elapsed):
+    print(f"Finished in {elapsed:.1f} s")
+    print(f"{'tool':<6} {'requests':>8} {'errors':>7} {'ok/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for tool, stats in summary.items():
+        latencies = " ".join(f"{stats.get(key, float('nan')):>9.1f}" for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms"))
+        print(f"{tool:<6} {stats['requests']:>8} {stats['errors']:>7} {stats['throughput_per_sec']:>8.2f} {latencies}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=f"http://127.0.0.1:{SERVER_PORT}/mcp")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("pptx=1,docx=1,xlsx=1,eml=1"),
+                        help="tool weights, e.g. pptx=1,docx=2,xlsx=1,eml=4")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=8, help="closed-loop clients (default)")
+    mode.add_argument("--rps", type=float, help="open-loop requests per second")
+    parser.add_argument("--connections", type=int, default=8, help="client sessions used in open-loop mode")
+    parser.add_argument("--cacheable", action="store_true", help="repeat identical arguments (result cache hits)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn-server", action="store_true", help="start src/main.py for the test")
+    parser.add_argument("--backend", choices=["local", "s3"], default="local", help="upload backend of spawned server")
+    parser.add_argument("--json", help="save summary to JSON file")
+    args = parser.parse_args()
+
+    test = LoadTest(args.url, args.mix, unique=not args.cacheable, seed=args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="office-docs-loadtest-") as output_dir:
+        server = moto_server = None
+        if args.spawn_server:
+            server, moto_server = start_server(args.backend, output_dir)
+        try:
+            start = time.perf_counter()
+            if args.rps:
+                asyncio.run(test.open_loop(args.rps, args.duration, args.connections))
+            else:
+                asyncio.run(test.closed_loop(args.concurrency, args.duration))
+            elapsed = time.perf_counter() - start
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=30)
+            if moto_server:
+                moto_server.stop()
+
+    summary = test.report(elapsed)
+    print_report(summary, elapsed)
+
+    errors = [error for _, _, error in test.samples if error]
+    if errors:
+        print(f"First error: {errors[0]}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"arguments": {key: value for key, value in vars(args).items() if key != "mix"},
+                       "mix": args.mix, "elapsed": elapsed, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
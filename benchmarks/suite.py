@@ -0,0 +1,178 @@
+"""Benchmark suite for all four document generators.
+
+Runs every workload in a fresh process with UPLOAD_STRATEGY=LOCAL and a temporary output
+directory, and reports throughput, latency percentiles and peak RSS. Results can be saved
+as JSON and compared with an earlier run to spot regressions:
+
+    python benchmarks/suite.py --json before.json
+    python benchmarks/suite.py --compare before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent / "src"))
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+import workloads
+
+# Repeated identical decks would be cloned from the slide cache
+NO_SLIDE_CACHE = {"SLIDE_CACHE_ENABLED": "false"}
+
+# name: (generator, workload arguments, iterations, env. variables of the workload process)
+WORKLOADS = {
+    "pptx_10_slides": ("pptx", lambda: workloads.deck_slides(10), 20, NO_SLIDE_CACHE),
+    "pptx_100_slides": ("pptx", lambda: workloads.deck_slides(100), 5, NO_SLIDE_CACHE),
+    "pptx_500_slides": ("pptx", lambda: workloads.deck_slides(500), 3, NO_SLIDE_CACHE),
+    "pptx_boilerplate_decks": ("pptx", lambda: workloads.boilerplate_decks(decks=50, slides=10), 1, {}),
+    "docx_long_lists": ("docx", lambda: workloads.markdown_document(list_items=2000, table_rows=0), 5, {}),
+    "docx_large_table": ("docx", lambda: workloads.markdown_document(list_items=10, table_rows=2000), 5, {}),
+    "xlsx_cross_table_formulas": ("xlsx", lambda: workloads.formula_sheet(tables=20, rows=200), 5, {}),
+    "eml_bulk": ("eml", lambda: [workloads.email(index) for index in range(200)], 1, {}),
+}
+
+
+def percentile(values, percent):
+    """Returns nearest-rank percentile of the values"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def get_generator(kind):
+    """Returns the public create function of the generator, called with the workload arguments"""
+    if kind == "pptx":
+        from create_pptx import create_presentation
+        return lambda arguments: create_presentation(arguments["slides"], arguments["format"])
+    if kind == "docx":
+        from create_docx import markdown_to_word
+        return lambda arguments: markdown_to_word(arguments["markdown_content"])
+    if kind == "xlsx":
+        from create_xlsx import markdown_to_excel
+        return lambda arguments: markdown_to_excel(arguments["markdown_content"])
+    if kind == "eml":
+        from create_msg import create_eml
+        return lambda arguments: create_eml(
+            to=arguments["to"], cc=arguments["cc"], re=arguments["subject"], content=arguments["content"],
+            priority=arguments["priority"], language=arguments["language"]
+        )
+    raise ValueError(f"Unknown generator {kind}")
+
+
+def run_workload(name, iterations):
+    """Runs one workload in the current (fresh) process and returns its measurements"""
+    kind, make_arguments, default_iterations, env = WORKLOADS[name]
+    iterations = iterations or default_iterations
+
+    # Read by the generator modules at import time
+    os.environ.update(env)
+
+    generate = get_generator(kind)
+    arguments = make_arguments()
+    # Bulk workloads are a list of calls, each call is measured
+    calls = arguments if isinstance(arguments, list) else [arguments]
+
+    # Warm up imports and template cache, the generators print their progress
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate(calls[0])
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(iterations):
+            for call in calls:
+                call_start = time.perf_counter()
+                result = generate(call)
+                latencies.append(time.perf_counter() - call_start)
+                if not result or "Error" in str(result):
+                    raise RuntimeError(f"{name} failed: {result}")
+    total = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss_unit = 1 if platform.system() == "Darwin" else 1024
+    return {
+        "workload": name,
+        "generator": kind,
+        "calls": len(latencies),
+        "throughput_per_sec": len(latencies) / total,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / (1024 * 1024),
+        "warm_rss_mb": rss_before * rss_unit / (1024 * 1024),
+    }
+
+
+def print_results(results, baseline=None):
+    """Prints results as a table, with p50 change against the baseline if given"""
+    baseline = {result["workload"]: result for result in baseline or []}
+    header = f"{'workload':<28} {'calls':>6} {'ops/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MB':>8}"
+    print(header + ("  p50 vs baseline" if baseline else ""))
+    for result in results:
+        line = (f"{result['workload']:<28} {result['calls']:>6} {result['throughput_per_sec']:>9.2f} "
+                f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['peak_rss_mb']:>8.1f}")
+        previous = baseline.get(result["workload"])
+        if previous:
+            change = (result["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"] * 100
+            line += f"  {change:+.1f} %"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workloads", nargs="*", help=f"workloads to run (default all): {', '.join(WORKLOADS)}")
+    parser.add_argument("--iterations", type=int, default=0, help="iterations per workload (default per workload)")
+    parser.add_argument("--json", help="save results to JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    names = args.workloads or list(WORKLOADS)
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix="office-docs-bench-") as output_dir:
+        # Read by upload_file at import time in the workload processes
+        os.environ["UPLOAD_STRATEGY"] = "LOCAL"
+        os.environ["LOCAL_OUTPUT_DIR"] = output_dir
+
+        results = []
+        context = multiprocessing.get_context("spawn")
+        for name in names:
+            # Fresh process per workload, so peak RSS belongs to the workload only
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results.append(pool.submit(run_workload, name, args.iterations).result())
+            for file_name in os.listdir(output_dir):
+                os.remove(os.path.join(output_dir, file_name))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
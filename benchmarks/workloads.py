@@ -0,0 +1,111 @@
+"""Synthetic, reproducible workloads for the document generators.
+
+Each generator returns the keyword arguments of the matching MCP tool, so the same
+workloads are used by the benchmark suite and the load test.
+"""
+
+import random
+
+WORDS = (
+    "agreement party seller buyer goods delivery price payment invoice term notice "
+    "liability warranty clause article annex schedule obligation confidential period "
+    "termination amendment jurisdiction dispute service quality report revenue budget"
+).split()
+
+
+def sentence(rng, words=12):
+    """Returns random sentence of given number of words"""
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def deck_slides(slides, seed=0):
+    """Returns arguments of create_powerpoint_presentation: title slide, sections and content slides with nested bullets"""
+    rng = random.Random(seed)
+    deck = [{"slide_type": "title", "slide_title": "Quarterly Report", "author": "Benchmark"}]
+    for index in range(slides):
+        if index % 10 == 0:
+            deck.append({"slide_type": "section", "slide_title": f"Section {index // 10 + 1}"})
+        bullets = []
+        for _ in range(3):
+            bullets.append({"text": sentence(rng, 8), "indentation_level": 1})
+            bullets.append({"text": sentence(rng, 10), "indentation_level": 2})
+            bullets.append({"text": sentence(rng, 6), "indentation_level": 3})
+        deck.append({"slide_type": "content", "slide_title": f"Slide {index + 1}", "slide_text": bullets})
+    return {"slides": deck, "format": "16:9"}
+
+
+def boilerplate_decks(decks, slides, seed=0):
+    """Returns arguments of create_powerpoint_presentation calls sharing title, agenda and disclaimer slides"""
+    boilerplate = [
+        {"slide_type": "title", "slide_title": "Quarterly Report", "author": "Benchmark"},
+        {"slide_type": "content", "slide_title": "Agenda", "slide_text": [
+            {"text": topic, "indentation_level": 1} for topic in ("Results", "Outlook", "Risks", "Questions")
+        ]},
+    ]
+    disclaimer = {"slide_type": "content", "slide_title": "Disclaimer", "slide_text": [
+        {"text": sentence(random.Random(seed), 30), "indentation_level": 1} for _ in range(4)
+    ]}
+
+    calls = []
+    for index in range(decks):
+        deck = deck_slides(slides, seed=seed * 100003 + index)
+        calls.append({"slides": boilerplate + deck["slides"][1:] + [disclaimer], "format": deck["format"]})
+    return calls
+
+
+def markdown_document(list_items, table_rows, table_cols=6, seed=0):
+    """Returns arguments of create_word_from_markdown: contract-like nested lists and a large table"""
+    rng = random.Random(seed)
+    lines = ["# Framework Agreement", "", sentence(rng, 30), ""]
+
+    for article in range(1, list_items // 5 + 1):
+        lines.append(f"{article}. Article {article} - **{rng.choice(WORDS).title()}**")
+        for provision in range(1, 5):
+            lines.append(f"   {provision}. {sentence(rng, 20)} See *Annex {provision}*.")
+    lines.append("")
+
+    lines.append("| " + " | ".join(f"Column {col}" for col in range(table_cols)) + " |")
+    lines.append("|" + "---|" * table_cols)
+    for row in range(table_rows):
+        cells = [f"Item {row}"] + [str(rng.randint(1, 10000)) for _ in range(table_cols - 1)]
+        lines.append("| " + " | ".join(cells) + " |")
+
+    return {"markdown_content": "\n".join(lines)}
+
+
+def formula_sheet(tables, rows, seed=0):
+    """Returns arguments of create_excel_from_markdown: tables with row formulas and cross-table summaries"""
+    rng = random.Random(seed)
+    lines = ["# Budget"]
+
+    for table in range(1, tables + 1):
+        lines += ["", f"## Table {table}", "", "| Item | Q1 | Q2 | Q3 | Total | Share |", "|---|---|---|---|---|---|"]
+        for row in range(rows):
+            lines.append(
+                f"| Item {row} | {rng.randint(1, 1000)} | {rng.randint(1, 1000)} | {rng.randint(1, 1000)} "
+                f"| =SUM(B[0]:D[0]) | =E[0]/T{table}.SUM(E[0]:E[{rows - 1}]) |"
+            )
+
+    # Summary of all tables referring back to each of them
+    lines += ["", "## Summary", "", "| **Table** | Total | *Average* |", "|---|---|---|"]
+    for table in range(1, tables + 1):
+        lines.append(f"| Table {table} | =T{table}.SUM(E[0]:E[{rows - 1}]) | =T{table}.AVERAGE(B[0]:D[{rows - 1}]) |")
+
+    return {"markdown_content": "\n".join(lines)}
+
+
+def email(index, paragraphs=5, seed=0):
+    """Returns arguments of create_email_draft for the index-th email of a bulk run"""
+    rng = random.Random(seed * 100003 + index)
+    body = [f"<p>Dear client {index},</p>", "<h2>Summary</h2>"]
+    body += [f"<p>{sentence(rng, 40)}</p>" for _ in range(paragraphs)]
+    body += ["<ul>"] + [f"<li>{sentence(rng, 8)}</li>" for _ in range(5)] + ["</ul>", "<p>Best regards,<br>Team</p>"]
+    return {
+        "content": "\n".join(body),
+        "subject": f"Monthly report {index}",
+        "to": [f"client{index}@example.com"],
+        "cc": ["office@example.com"],
+        "priority": "normal",
+        "language": "en-US",
+    }
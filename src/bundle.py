@@ -0,0 +1,61 @@
+import os
+import time
+import tempfile
+import zipfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bundles up to this size are kept in memory, larger ones spill to a temporary file
+BUNDLE_SPOOL_MAX_SIZE = int(os.environ.get("BUNDLE_SPOOL_MAX_SIZE", str(32 * 1024 * 1024)))
+
+# Office documents are ZIP archives already, compressing them again only costs time
+STORED_SUFFIXES = {"pptx", "docx", "xlsx"}
+
+
+class ZipBundle:
+    """ZIP archive of several documents, written incrementally as the documents are built.
+
+    Each document is written straight from its buffer into the archive and the buffer is
+    closed, so a document is never held twice. The archive is kept in a spooled temporary
+    file that moves to disk once it grows over BUNDLE_SPOOL_MAX_SIZE.
+    """
+
+    def __init__(self, spool_max_size=None):
+        self.file_object = tempfile.SpooledTemporaryFile(max_size=spool_max_size or BUNDLE_SPOOL_MAX_SIZE)
+        self.archive = zipfile.ZipFile(self.file_object, "w")
+        self.names = set()
+
+    def add(self, name, file_object):
+        """Write file-like object to the archive under given name and close it.
+
+        :param name: File name in the archive, made unique by a counter if already used
+        :param file_object: BytesIO object with the document
+        :return: File name used in the archive
+        """
+
+        base, _, suffix = name.rpartition(".")
+        counter = 1
+        while name in self.names:
+            counter += 1
+            name = f"{base}_{counter}.{suffix}"
+        self.names.add(name)
+
+        compression = zipfile.ZIP_STORED if suffix in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = compression
+
+        try:
+            with self.archive.open(info, "w") as entry, file_object.getbuffer() as view:
+                entry.write(view)
+        finally:
+            file_object.close()
+
+        return name
+
+    def close(self):
+        """Finish the archive and return its file object positioned at the start"""
+        self.archive.close()
+        logger.info(f"Bundled {len(self.names)} documents into {self.file_object.tell()} bytes")
+        self.file_object.seek(0)
+        return self.file_object
@@ -1,23 +1,18 @@
-from os.path import exists
 import re
-from docx import Document
+from typing import NamedTuple, Optional
 from docx.shared import Inches
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 from docx.opc.constants import RELATIONSHIP_TYPE
+from docx.text.paragraph import Paragraph
 from upload_file import upload_file
-from pathlib import Path
+from template_cache import template_cache
+from profiling import span
+from markdown_blocks import iter_blocks, iter_table_rows, BLANK, HEADING, TABLE, LIST_ITEM, QUOTE, RULE
 import io
 
-def load_templates():
-    """Loads presentation templates"""
-    custom_template = Path(__file__).parent / "template.docx"
-    if exists(custom_template):
-        template = custom_template
-    else:
-        # If no template found, create a blank document
-        return None
-    return str(template)
+BULLET_STYLES = ['List Bullet', 'List Bullet 2', 'List Bullet 3']
+NUMBER_STYLES = ['List Number', 'List Number 2', 'List Number 3']
 
 def add_hyperlink(paragraph, text, url, color="0000FF", underline=True):
     """Adds a hyperlink to a paragraph"""
@@ -46,105 +41,139 @@ def add_hyperlink(paragraph, text, url, color="0000FF", underline=True):
 
     paragraph._p.append(hyperlink)
 
-def parse_inline_formatting(text, paragraph):
-    """Parse inline markdown formatting like **bold**, *italic*, and [links](url)"""
-    # First handle escape characters
-    text = handle_escapes(text)
-
-    # Handle line breaks (two spaces at end of line)
-    # Split by line breaks while preserving them
-    line_parts = text.split('  \n')
-
-    for line_idx, line_part in enumerate(line_parts):
-        if not line_part and line_idx == len(line_parts) - 1:
-            continue
+# Inline markdown tokens: escaped ASCII punctuation, `code`, [text](url) and emphasis delimiters
+INLINE_TOKEN_PATTERN = re.compile(
+    r'\\([!-/:-@\[-`{-~])'
+    r'|`([^`]*)`'
+    r'|\[([^\]]*)\]\(([^)]*)\)'
+    r'|(\*\*|\*)'
+)
+# Characters that may start an inline token, text without them is added as a single run
+INLINE_SPECIAL_PATTERN = re.compile(r'[\\`\[*]')
+LINE_BREAK = '  \n'
+# Characters python-docx turns into separate run elements
+RUN_CONTROL_PATTERN = re.compile(r'[\t\n\r]')
+
+class InlineRun(NamedTuple):
+    """Text run produced by parse_inline_runs, url is set for hyperlinks"""
+    text: str
+    bold: bool = False
+    italic: bool = False
+    code: bool = False
+    url: Optional[str] = None
+
+def tokenize_inline(segment):
+    """Splits one line of text into (text, delimiter, code, link_url) tokens in a single scan"""
+    tokens = []
+    position = 0
+    for match in INLINE_TOKEN_PATTERN.finditer(segment):
+        if match.start() > position:
+            tokens.append((segment[position:match.start()], None, False, None))
+        escaped, code, link_text, url, delimiter = match.groups()
+        if escaped is not None:
+            tokens.append((escaped, None, False, None))
+        elif code is not None:
+            tokens.append((code, None, True, None))
+        elif url is not None:
+            tokens.append((link_text, None, False, url))
+        else:
+            tokens.append((delimiter, delimiter, False, None))
+        position = match.end()
+    if position < len(segment):
+        tokens.append((segment[position:], None, False, None))
+    return tokens
 
-        # Split text by formatting markers while preserving the markers
-        parts = re.split(r'(\*\*.*?\*\*|\*.*?\*|`.*?`|\[.*?\]\(.*?\))', line_part)
+def parse_inline_runs(text):
+    """Parse inline markdown formatting into a list of InlineRun, None marks a line break.
 
-        for part in parts:
-            if not part:
-                continue
+    Emphasis delimiters are paired in order within each line, so nested emphasis like
+    ***text*** or **bold *both* bold** works and an unmatched delimiter stays literal text.
+    """
+    runs = []
+    line_parts = text.split(LINE_BREAK)
 
-            # Bold text (**text**)
-            if part.startswith('**') and part.endswith('**'):
-                bold_text = part[2:-2]
-                paragraph.add_run(bold_text).bold = True
-            # Italic text (*text*)
-            elif part.startswith('*') and part.endswith('*'):
-                italic_text = part[1:-1]
-                paragraph.add_run(italic_text).italic = True
-            # Inline code (`code`)
-            elif part.startswith('`') and part.endswith('`'):
-                code_text = part[1:-1]
-                run = paragraph.add_run(code_text)
-                run.font.name = 'Courier New'
-            # Links [text](url)
-            elif part.startswith('[') and '](' in part and part.endswith(')'):
-                link_match = re.match(r'\[(.*?)\]\((.*?)\)', part)
-                if link_match:
-                    link_text, url = link_match.groups()
-                    add_hyperlink(paragraph, link_text, url)
-            else:
-                # Plain text
-                paragraph.add_run(part)
-
-        # Add line break if this isn't the last part
-        if line_idx < len(line_parts) - 1:
-            paragraph.add_run().add_break()
-
-def handle_escapes(text):
-    """Handle backslash escaped characters"""
-    # Replace escaped characters with placeholders first to avoid conflicts
-    escape_map = {}
-    placeholder_counter = 0
-
-    def replace_escape(match):
-        nonlocal placeholder_counter
-        escaped_char = match.group(1)
-        placeholder = f"__ESC_{placeholder_counter}__"
-        escape_map[placeholder] = escaped_char
-        placeholder_counter += 1
-        return placeholder
-
-    # Find and replace all escaped characters
-    text = re.sub(r'\\(.)', replace_escape, text)
-
-    # After all other processing, restore the escaped characters
-    for placeholder, char in escape_map.items():
-        text = text.replace(placeholder, char)
-
-    return text
-
-def parse_table(lines, start_idx):
-    """Parse markdown table and return the table data and next line index"""
-    table_lines = []
-    i = start_idx
-
-    # Find all table lines
-    while i < len(lines):
-        line = lines[i].strip()
-        if line.startswith('|') and line.endswith('|'):
-            table_lines.append(line)
-            i += 1
-        else:
-            break
-
-    if len(table_lines) < 2:  # Need at least header and separator
-        return None, start_idx + 1
+    for line_idx, line_part in enumerate(line_parts):
+        if line_idx:
+            runs.append(None)
 
-    # Parse table data
-    table_data = []
-    for line in table_lines:
-        # Skip separator line (contains dashes)
-        if '---' in line or ':-:' in line or ':--' in line or '--:' in line:
+        # Plain text fast path
+        if not INLINE_SPECIAL_PATTERN.search(line_part):
+            if line_part:
+                runs.append(InlineRun(line_part))
             continue
 
-        # Split by | and clean up
-        cells = [cell.strip() for cell in line.split('|')[1:-1]]  # Remove empty first/last
-        table_data.append(cells)
+        tokens = tokenize_inline(line_part)
+
+        # Last delimiter of an odd count has no closing pair
+        for delimiter in ('**', '*'):
+            positions = [i for i, token in enumerate(tokens) if token[1] == delimiter]
+            if len(positions) % 2:
+                tokens[positions[-1]] = (delimiter, None, False, None)
+
+        bold = italic = False
+        for token_text, delimiter, code, url in tokens:
+            if delimiter == '**':
+                bold = not bold
+            elif delimiter == '*':
+                italic = not italic
+            elif url is not None:
+                runs.append(InlineRun(token_text, url=url))
+            elif token_text:
+                previous = runs[-1] if runs else None
+                # Merge with the previous run of the same formatting
+                if (previous is not None and previous.url is None and previous.bold == bold
+                        and previous.italic == italic and previous.code == code):
+                    runs[-1] = previous._replace(text=previous.text + token_text)
+                else:
+                    runs.append(InlineRun(token_text, bold, italic, code))
+
+    return runs
+
+def make_run_element(text, bold=False, italic=False, code=False):
+    """Returns w:r element of a formatted text run"""
+    r = OxmlElement('w:r')
+
+    if bold or italic or code:
+        rPr = OxmlElement('w:rPr')
+        if code:
+            fonts = OxmlElement('w:rFonts')
+            fonts.set(qn('w:ascii'), 'Courier New')
+            fonts.set(qn('w:hAnsi'), 'Courier New')
+            rPr.append(fonts)
+        if bold:
+            rPr.append(OxmlElement('w:b'))
+        if italic:
+            rPr.append(OxmlElement('w:i'))
+        r.append(rPr)
+
+    if RUN_CONTROL_PATTERN.search(text):
+        # Tabs and line breaks need their own elements, let python-docx handle them
+        r.text = text
+    else:
+        t = OxmlElement('w:t')
+        t.text = text
+        if text[0] == ' ' or text[-1] == ' ':
+            t.set(qn('xml:space'), 'preserve')
+        r.append(t)
+
+    return r
+
+def add_inline_runs(paragraph, runs):
+    """Adds runs returned by parse_inline_runs to a paragraph"""
+    p = paragraph._p
+    for run in runs:
+        if run is None:
+            r = OxmlElement('w:r')
+            r.append(OxmlElement('w:br'))
+            p.append(r)
+        elif run.url is not None:
+            add_hyperlink(paragraph, run.text, run.url)
+        else:
+            p.append(make_run_element(run.text, run.bold, run.italic, run.code))
 
-    return table_data, i
+def parse_inline_formatting(text, paragraph):
+    """Parse inline markdown formatting like **bold**, *italic*, `code`, [links](url) and \\escapes"""
+    add_inline_runs(paragraph, parse_inline_runs(text))
 
 def add_table_to_doc(table_data, doc):
     """Add table data to Word document"""
@@ -157,158 +186,104 @@ def add_table_to_doc(table_data, doc):
     word_table = doc.add_table(rows=rows, cols=cols)
     word_table.style = 'Table Grid'
 
-    for i, row_data in enumerate(table_data):
-        for j, cell_text in enumerate(row_data):
-            if j < cols:
-                cell = word_table.cell(i, j)
-                if cell.paragraphs:
-                    cell.paragraphs[0].clear()
-
-                cell_paragraph = cell.paragraphs[0]
-                parse_inline_formatting(cell_text, cell_paragraph)
-
-def markdown_to_word(markdown_content):
-    """Convert Markdown to Word document."""
-    path = load_templates()
-
-    # Create document with or without template
-    if path:
-        doc = Document(path)
-    else:
-        doc = Document()  # Create blank document if no template
-        print("Warning: No template found, creating blank document")
-
-    # Split content into lines, but preserve line breaks within paragraphs
-    lines = markdown_content.split('\n')
-    i = 0
-
-    try:
-        while i < len(lines):
-            line = lines[i]
-
-            # Handle multiple empty lines (preserve spacing)
-            if not line.strip():
-                empty_line_count = 0
-                start_empty = i
-
-                # Count consecutive empty lines
-                while i < len(lines) and not lines[i].strip():
-                    empty_line_count += 1
-                    i += 1
-
-                # Add appropriate spacing based on number of empty lines
-                if empty_line_count == 1:
-                    # Single empty line = normal paragraph break (already handled by next iteration)
-                    pass
-                elif empty_line_count >= 2:
-                    # Multiple empty lines = add extra spacing
-                    # Add one empty paragraph for each additional empty line beyond the first
-                    for _ in range(empty_line_count - 1):
-                        doc.add_paragraph()
-
+    # Walk the generated rows and cells directly, table.cell() rebuilds the cell grid on every call
+    for row_data, tr in zip(table_data, word_table._tbl.tr_lst):
+        for cell_text, tc in zip(row_data, tr.tc_lst):
+            if not cell_text:
                 continue
 
-            # Check if this line ends with two spaces (line break)
-            if line.endswith('  '):
-                # Collect lines that are part of the same paragraph (connected by line breaks)
-                paragraph_lines = []
-                while i < len(lines):
-                    current_line = lines[i]
-                    if not current_line.strip():  # Empty line ends the paragraph
-                        break
-
-                    paragraph_lines.append(current_line)
-                    i += 1
+            p = tc.p_lst[0]
+            if LINE_BREAK not in cell_text and not INLINE_SPECIAL_PATTERN.search(cell_text):
+                # Plain text cell, no need for the inline parser
+                p.append(make_run_element(cell_text))
+            else:
+                add_inline_runs(Paragraph(p, word_table), parse_inline_runs(cell_text))
 
-                    # If line doesn't end with two spaces, this paragraph is complete
-                    if not current_line.endswith('  '):
-                        break
+def build_word(markdown_content):
+    """Convert Markdown to Word document and return it as BytesIO object."""
+    # Create document from the cached template (blank document if no template found)
+    with span("docx", "template"):
+        doc = template_cache.get("docx")
 
-                # Join lines with line break markers
-                full_text = '  \n'.join(paragraph_lines)
+    previous_kind = None
 
-                # Determine what type of content this is
-                first_line = paragraph_lines[0].strip()
+    try:
+        # Split content into lines, but preserve line breaks within paragraphs
+        with span("docx", "parse"):
+            lines = markdown_content.split('\n')
+            blocks = list(iter_blocks(lines))
+
+        with span("docx", "build"):
+            for block in blocks:
+
+                # Handle multiple empty lines (preserve spacing)
+                if block.kind == BLANK:
+                    # Empty lines within lists only separate the items
+                    if previous_kind != LIST_ITEM:
+                        # Single empty line = normal paragraph break, multiple empty lines = add
+                        # one empty paragraph for each additional empty line beyond the first
+                        for _ in range(block.count - 1):
+                            doc.add_paragraph()
+                    continue
+
+                previous_kind = block.kind
 
                 # Headers
-                if first_line.startswith('#'):
-                    header_level = len(first_line) - len(first_line.lstrip('#'))
-                    header_text = first_line.lstrip('#').strip()
-                    heading = doc.add_heading('', level=min(header_level, 6))
-                    parse_inline_formatting(header_text, heading)
-
-                # Block quotes
-                elif first_line.startswith('>'):
-                    quote_text = full_text[1:].strip()  # Remove > from beginning
+                if block.kind == HEADING:
+                    heading = doc.add_heading('', level=min(block.level, 6))
+                    parse_inline_formatting(block.text, heading)
+
+                # Tables
+                elif block.kind == TABLE:
+                    table_data = list(iter_table_rows(lines, block.start, block.end))
+                    if table_data:
+                        with span("docx", "table", metric=False):
+                            add_table_to_doc(table_data, doc)
+
+                # Lists, use Word's built-in list formatting - it handles numbering restart automatically
+                elif block.kind == LIST_ITEM:
+                    style_array = NUMBER_STYLES if block.ordered else BULLET_STYLES
+                    paragraph = doc.add_paragraph(style=style_array[min(block.level, len(style_array) - 1)])
+                    parse_inline_formatting(block.text, paragraph)
+
+                # Horizontal rule
+                elif block.kind == RULE:
+                    # Add a horizontal line (simplified as empty paragraph with border)
+                    doc.add_paragraph()
+
+                # Block quotes (useful for legal citations)
+                elif block.kind == QUOTE:
                     quote_paragraph = doc.add_paragraph()
                     quote_paragraph.style = 'Quote'
-                    parse_inline_formatting(quote_text, quote_paragraph)
+                    parse_inline_formatting(block.text, quote_paragraph)
 
-                # Regular paragraph with line breaks
+                # Regular paragraphs
                 else:
                     paragraph = doc.add_paragraph()
-                    parse_inline_formatting(full_text, paragraph)
-
-                continue
-
-            line = line.strip()
-
-            # Headers
-            if line.startswith('#'):
-                header_level = len(line) - len(line.lstrip('#'))
-                header_text = line.lstrip('#').strip()
-                heading = doc.add_heading('', level=min(header_level, 6))
-                parse_inline_formatting(header_text, heading)
-                i += 1
-
-            # Tables
-            elif line.startswith('|'):
-                table_data, i = parse_table(lines, i)
-                if table_data:
-                    add_table_to_doc(table_data, doc)
-
-            # Ordered lists
-            elif re.match(r'^\d+\.\s+', line):
-                i = process_list_items(lines, i, doc, True, 0)
-
-            # Unordered lists
-            elif re.match(r'^[-*+]\s+', line):
-                i = process_list_items(lines, i, doc, False, 0)
-
-            # Horizontal rule
-            elif line.startswith('---') or line.startswith('***'):
-                # Add a horizontal line (simplified as empty paragraph with border)
-                paragraph = doc.add_paragraph()
-                i += 1
-
-            # Block quotes (useful for legal citations)
-            elif line.startswith('>'):
-                quote_text = line[1:].strip()
-                quote_paragraph = doc.add_paragraph()
-                quote_paragraph.style = 'Quote'
-                parse_inline_formatting(quote_text, quote_paragraph)
-                i += 1
-
-            # Regular paragraphs
-            else:
-                paragraph = doc.add_paragraph()
-                parse_inline_formatting(line, paragraph)
-                i += 1
+                    parse_inline_formatting(block.text, paragraph)
 
     except Exception as e:
         print(f"Error in parsing markdown: {e}")
         import traceback
         traceback.print_exc()
-        return f"Error in parsing markdown: {e}"
+        raise ValueError(f"Error in parsing markdown: {e}") from e
 
-    # Save the document to BytesIO and upload
-    try:
-        # Save to BytesIO object
+    # Save the document to BytesIO object
+    with span("docx", "serialize"):
         file_object = io.BytesIO()
         doc.save(file_object)
         file_object.seek(0)
+    return file_object
+
+def markdown_to_word(markdown_content):
+    """Convert Markdown to Word document."""
+    try:
+        file_object = build_word(markdown_content)
+    except ValueError as e:
+        return str(e)
 
-        # Upload and get result
+    # Upload the document
+    try:
         result = upload_file(file_object, "docx")
         file_object.close()
 
@@ -319,74 +294,3 @@ def markdown_to_word(markdown_content):
         import traceback
         traceback.print_exc()
         return f"Error saving/uploading Word document: {e}"
-
-def process_list_items(lines, start_idx, doc, is_ordered=False, level=0):
-    """Process markdown list items with proper Word numbering"""
-    bullet_styles = ['List Bullet', 'List Bullet 2', 'List Bullet 3']
-    number_styles = ['List Number', 'List Number 2', 'List Number 3']
-
-    style_array = number_styles if is_ordered else bullet_styles
-    style = style_array[min(level, len(style_array) - 1)]
-
-    i = start_idx
-
-    while i < len(lines):
-        line = lines[i].strip()
-
-        # Determine indentation level from original line
-        original_line = lines[i]
-        indent = len(original_line) - len(original_line.lstrip())
-        current_level = indent // 3  # Use 3 spaces per level to match typical markdown indentation
-
-        # If indentation doesn't match our expected level, this item doesn't belong to this list
-        if current_level != level:
-            break
-
-        # Check if this is a list item at our current level
-        if is_ordered:
-            list_match = re.match(r'^\d+\.\s+(.+)', line)
-        else:
-            list_match = re.match(r'^[-*+]\s+(.+)', line)
-
-        if not list_match:
-            break
-
-        item_text = list_match.group(1)
-
-        # Use Word's built-in list formatting - it handles numbering restart automatically
-        paragraph = doc.add_paragraph(style=style)
-        parse_inline_formatting(item_text, paragraph)
-
-        i += 1
-
-        # Look ahead for nested items
-        while i < len(lines):
-            if i >= len(lines):
-                break
-
-            next_line = lines[i].strip()
-            if not next_line:
-                i += 1
-                continue
-
-            next_original = lines[i]
-            next_indent = len(next_original) - len(next_original.lstrip())
-            next_level = next_indent // 3  # Use 3 spaces per level
-
-            if next_level > level:
-                # This is a nested item - process the nested list
-                if re.match(r'^\d+\.\s+', next_line):
-                    i = process_list_items(lines, i, doc, True, next_level)
-                elif re.match(r'^[-*+]\s+', next_line):
-                    i = process_list_items(lines, i, doc, False, next_level)
-                else:
-                    # Not a list item, stop processing nested items
-                    break
-            elif next_level == level:
-                # Same level item - continue in this loop
-                break
-            else:
-                # Lower level - return to parent
-                break
-
-    return i
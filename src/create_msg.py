@@ -1,43 +1,29 @@
+import base64
+import html
 import io
+from email.generator import BytesGenerator
 from email.mime.text import MIMEText
 from email.utils import formatdate
 from email.header import Header
+from functools import lru_cache
+import os
+import re
+import tempfile
+import time
 from upload_file import upload_file
+from profiling import span
 
+# Load env. variables for bulk email drafts
+EML_BULK_MAX_RECIPIENTS = int(os.environ.get("EML_BULK_MAX_RECIPIENTS", "1000"))
 
-def create_eml(to=None, cc=None, bcc=None, re=None, content=None, priority="normal", language="cs-CZ"):
-    """
-    Creates an unsent email draft in EML format with HTML content and specific formatting.
+# Characters of the body encoded at once, bounds memory used by the encoding
+EML_CHUNK_SIZE = int(os.environ.get("EML_CHUNK_SIZE", str(64 * 1024)))
 
-    Args:
-        to (list): List of recipient email addresses
-        cc (list): List of carbon copy recipient email addresses
-        bcc (list): List of blind carbon copy recipient email addresses
-        re (str): Subject of the email
-        content (str): HTML content to go inside the body tags
-        priority (str): Email priority ("low", "normal", "high")
-        language (str): Language code for proofreading (e.g., "cs-CZ", "en-US", "de-DE")
+# Base64 body lines have 76 characters, encoding 57 bytes each
+BASE64_LINE_BYTES = 57
 
-    Returns:
-        str: URL to the uploaded EML file
-        
-    Raises:
-        ValueError: If priority is not valid or required parameters are missing
-        Exception: If file upload fails
-    """
-    
-    # Validate priority
-    if priority.lower() not in ["low", "normal", "high"]:
-        raise ValueError("Priority must be 'low', 'normal', or 'high'")
-    
-    # Validate required parameters
-    if not content:
-        raise ValueError("Email content is required")
-    if not re:
-        raise ValueError("Email subject is required")
-
-    # Create the complete HTML document with the provided content in the body
-    complete_html = f"""
+# HTML document around the email content, the content goes between the two parts
+HTML_SHELL_START = """
     <html lang="{language}">
     <head>
         <meta http-equiv="Content-Type" content="text/html; charset=utf-8">
@@ -73,56 +59,319 @@ def create_eml(to=None, cc=None, bcc=None, re=None, content=None, priority="norm
         </style>
     </head>
     <body lang="{language}">
-        {content}
+        """
+HTML_SHELL_END = """
     </body>
     </html>
     """
 
-    buffer = None
+# Placeholder of a bulk email field, e.g. {{name}}
+FIELD_PATTERN = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+@lru_cache(maxsize=64)
+def get_html_shell(language):
+    """Returns (start, end) of the HTML document for the language, formatted once per language"""
+    return HTML_SHELL_START.format(language=language), HTML_SHELL_END.format(language=language)
+
+
+def make_message(to=None, cc=None, bcc=None, re=None, content=None, priority="normal", language="cs-CZ"):
+    """
+    Creates the MIME message of an unsent email draft, see build_eml for the arguments.
+
+    The message has headers only, its body is written by write_eml chunk by chunk.
+
+    Returns:
+        tuple: (MIME message, parts of the HTML body)
+
+    Raises:
+        ValueError: If priority is not valid or required parameters are missing
+    """
+    
+    # Validate priority
+    if priority.lower() not in ["low", "normal", "high"]:
+        raise ValueError("Priority must be 'low', 'normal', or 'high'")
+    
+    # Validate required parameters
+    if not content:
+        raise ValueError("Email content is required")
+    if not re:
+        raise ValueError("Email subject is required")
+
+    # Create the complete HTML document with the provided content in the body
+    shell_start, shell_end = get_html_shell(language)
+    body = (shell_start, content, shell_end)
+
+    # Create MIME text with explicit 8bit encoding to prevent "=" characters
+    msg = MIMEText("", 'html', 'utf-8')
+    msg.replace_header('Content-Transfer-Encoding', 'base64')
+
+    # Set email headers
+    if to:
+        msg["To"] = ", ".join(to)
+    if cc:
+        msg["Cc"] = ", ".join(cc)
+    if bcc:
+        msg["Bcc"] = ", ".join(bcc)
+
+    # Use Header object for proper UTF-8 encoding of the subject
+    msg["Subject"] = Header(re, 'utf-8')
+    msg["Date"] = formatdate(localtime=True)
+
+    # Set language headers for email clients
+    msg["Content-Language"] = language
+    msg["Accept-Language"] = language
+
+    # Set priority headers
+    if priority.lower() == "high":
+        msg["X-Priority"] = "1 (Highest)"
+        msg["X-MSMail-Priority"] = "High"
+        msg["Importance"] = "High"
+    elif priority.lower() == "low":
+        msg["X-Priority"] = "5 (Lowest)"
+        msg["X-MSMail-Priority"] = "Low"
+        msg["Importance"] = "Low"
+
+    # Add headers to indicate this is an unsent draft
+    msg["X-Unsent"] = "1"
+
+    return msg, body
+
+
+def write_base64(parts, file_object, chunk_size=None):
+    """Writes text parts UTF-8 and base64 encoded in lines of 76 characters, one chunk at a time"""
+    chunk_size = chunk_size or EML_CHUNK_SIZE
+    rest = b""
+    for part in parts:
+        for start in range(0, len(part), chunk_size):
+            data = rest + part[start:start + chunk_size].encode("utf-8")
+            # Whole lines are written, the remaining bytes go to the next chunk
+            end = len(data) - len(data) % BASE64_LINE_BYTES
+            file_object.write(base64.encodebytes(data[:end]))
+            rest = data[end:]
+    if rest:
+        file_object.write(base64.encodebytes(rest))
+
+
+def write_eml(msg, body, file_object, unixfrom=False):
+    """
+    Writes email draft created by make_message to a binary file object.
+
+    Same output as msg.as_bytes() with the body as payload, without holding the encoded
+    message in memory.
+
+    Returns:
+        int: Number of bytes written
+    """
+    start = file_object.tell()
+    BytesGenerator(file_object, mangle_from_=False).flatten(msg, unixfrom=unixfrom)
+    write_base64(body, file_object)
+    return file_object.tell() - start
+
+
+def build_eml(to=None, cc=None, bcc=None, re=None, content=None, priority="normal", language="cs-CZ"):
+    """
+    Builds an unsent email draft in EML format with HTML content and specific formatting.
+
+    Args:
+        to (list): List of recipient email addresses
+        cc (list): List of carbon copy recipient email addresses
+        bcc (list): List of blind carbon copy recipient email addresses
+        re (str): Subject of the email
+        content (str): HTML content to go inside the body tags
+        priority (str): Email priority ("low", "normal", "high")
+        language (str): Language code for proofreading (e.g., "cs-CZ", "en-US", "de-DE")
+
+    Returns:
+        io.BytesIO: EML file contents
+
+    Raises:
+        ValueError: If priority is not valid or required parameters are missing
+        Exception: If the message cannot be built
+    """
+
+    try:
+        with span("eml", "build"):
+            msg, body = make_message(to=to, cc=cc, bcc=bcc, re=re, content=content, priority=priority, language=language)
+
+        # Write message to file-like object
+        with span("eml", "serialize"):
+            buffer = io.BytesIO()
+            write_eml(msg, body, buffer)
+            buffer.seek(0)
+        return buffer
+
+    except ValueError:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to create email draft: {str(e)}")
+
+
+def write_eml_file(to=None, cc=None, bcc=None, re=None, content=None, priority="normal", language="cs-CZ"):
+    """
+    Builds an unsent email draft and writes it to a temporary file.
+
+    Takes the same arguments as build_eml. The message is written chunk by chunk, so it is
+    never held in memory as a whole, and only the path of the file is returned from the
+    build worker. The caller uploads the file and removes it.
+
+    Returns:
+        str: Path of the temporary EML file
+    """
+
+    try:
+        with span("eml", "build"):
+            msg, body = make_message(to=to, cc=cc, bcc=bcc, re=re, content=content, priority=priority, language=language)
+
+        with span("eml", "serialize"):
+            fd, path = tempfile.mkstemp(prefix="draft-", suffix=".eml")
+            try:
+                with os.fdopen(fd, "wb") as file_object:
+                    write_eml(msg, body, file_object)
+            except BaseException:
+                os.remove(path)
+                raise
+        return path
+
+    except ValueError:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to create email draft: {str(e)}")
+
+
+def compile_template(text):
+    """Splits text into literal parts and field names, fields are at odd positions"""
+    return FIELD_PATTERN.split(text)
+
+
+def render_template(parts, fields, escape=False):
+    """Returns text of the compiled template with the fields filled in
+
+    :param parts: Template compiled by compile_template
+    :param fields: Dictionary of field values
+    :param escape: Escape field values for HTML
+    :raises ValueError: If a field has no value
+    """
+    if len(parts) == 1:
+        return parts[0]
+
+    text = []
+    for index, part in enumerate(parts):
+        if index % 2:
+            if part not in fields:
+                raise ValueError(f"Missing value of field '{part}'")
+            part = str(fields[part])
+            if escape:
+                part = html.escape(part)
+        text.append(part)
+    return "".join(text)
+
+
+def iter_bulk_messages(content, subject, recipients, priority="normal", language="cs-CZ"):
+    """
+    Generates personalised email drafts of one template, one for each recipient.
+
+    Args:
+        content (str): HTML content with {{field}} placeholders
+        subject (str): Subject with {{field}} placeholders
+        recipients (list): Dictionaries with 'to', 'cc', 'bcc' lists, 'fields' with the
+            placeholder values and optional 'name' of the draft file
+        priority (str): Email priority ("low", "normal", "high")
+        language (str): Language code for proofreading (e.g., "cs-CZ", "en-US", "de-DE")
+
+    Yields:
+        tuple: (file name without extension, MIME message, parts of the HTML body)
+
+    Raises:
+        ValueError: If there are no or too many recipients, or a field value is missing
+    """
+
+    if not recipients:
+        raise ValueError("At least one recipient is required")
+    if len(recipients) > EML_BULK_MAX_RECIPIENTS:
+        raise ValueError(f"At most {EML_BULK_MAX_RECIPIENTS} recipients are allowed")
+
+    # Templates are parsed once, field values are HTML-escaped in the content only
+    content_parts = compile_template(content or "")
+    subject_parts = compile_template(subject or "")
+
+    for index, recipient in enumerate(recipients, start=1):
+        fields = recipient.get("fields") or {}
+        try:
+            msg, body = make_message(
+                to=recipient.get("to"),
+                cc=recipient.get("cc"),
+                bcc=recipient.get("bcc"),
+                re=render_template(subject_parts, fields),
+                content=render_template(content_parts, fields, escape=True),
+                priority=priority,
+                language=language,
+            )
+        except ValueError as e:
+            raise ValueError(f"Recipient {index}: {e}")
+
+        name = os.path.basename(str(recipient.get("name") or f"email_{index}"))
+        yield name, msg, body
+
+
+def build_eml_drafts(content=None, subject=None, recipients=None, priority="normal", language="cs-CZ"):
+    """
+    Builds personalised email drafts, see iter_bulk_messages for the arguments.
+
+    Returns:
+        list: (file name without extension, io.BytesIO with EML file contents) of each draft
+    """
+
+    drafts = []
+    with span("eml", "build"):
+        for name, msg, body in iter_bulk_messages(content, subject, recipients, priority, language):
+            buffer = io.BytesIO()
+            write_eml(msg, body, buffer)
+            buffer.seek(0)
+            drafts.append((name, buffer))
+    return drafts
+
+
+def build_mbox(content=None, subject=None, recipients=None, priority="normal", language="cs-CZ"):
+    """
+    Builds personalised email drafts as one mbox file, see iter_bulk_messages for the arguments.
+
+    Returns:
+        io.BytesIO: mbox file contents
+    """
+
+    buffer = io.BytesIO()
+    with span("eml", "build"):
+        for _, msg, body in iter_bulk_messages(content, subject, recipients, priority, language):
+            # Each message starts with a "From " line and ends with an empty line. The body
+            # is base64 encoded, so no line in it starts with "From " and needs escaping.
+            msg.set_unixfrom(f"From MAILER-DAEMON {time.asctime()}")
+            write_eml(msg, body, buffer, unixfrom=True)
+            buffer.write(b"\n")
+    buffer.seek(0)
+    return buffer
+
+
+def create_eml(to=None, cc=None, bcc=None, re=None, content=None, priority="normal", language="cs-CZ"):
+    """
+    Creates an unsent email draft in EML format and uploads it.
+
+    Takes the same arguments as build_eml.
+
+    Returns:
+        str: URL to the uploaded EML file
+
+    Raises:
+        ValueError: If priority is not valid or required parameters are missing
+        Exception: If file upload fails
+    """
+
+    path = write_eml_file(to=to, cc=cc, bcc=bcc, re=re, content=content, priority=priority, language=language)
     try:
-        # Create MIME text with explicit 8bit encoding to prevent "=" characters
-        msg = MIMEText(complete_html, 'html', 'utf-8')
-        msg.replace_header('Content-Transfer-Encoding', 'base64')
-
-        # Set email headers
-        if to:
-            msg["To"] = ", ".join(to)
-        if cc:
-            msg["Cc"] = ", ".join(cc)
-        if bcc:
-            msg["Bcc"] = ", ".join(bcc)
-
-        # Use Header object for proper UTF-8 encoding of the subject
-        msg["Subject"] = Header(re, 'utf-8')
-        msg["Date"] = formatdate(localtime=True)
-
-        # Set language headers for email clients
-        msg["Content-Language"] = language
-        msg["Accept-Language"] = language
-
-        # Set priority headers
-        if priority.lower() == "high":
-            msg["X-Priority"] = "1 (Highest)"
-            msg["X-MSMail-Priority"] = "High"
-            msg["Importance"] = "High"
-        elif priority.lower() == "low":
-            msg["X-Priority"] = "5 (Lowest)"
-            msg["X-MSMail-Priority"] = "Low"
-            msg["Importance"] = "Low"
-
-        # Add headers to indicate this is an unsent draft
-        msg["X-Unsent"] = "1"
-
-        # Convert message to file-like object
-        buffer = io.BytesIO()
-        buffer.write(msg.as_bytes())
-        buffer.seek(0)
-
-        url = upload_file(buffer, "eml")
-        return url
-        
+        with open(path, "rb") as file_object:
+            return upload_file(file_object, "eml")
+
     except Exception as e:
         raise Exception(f"Failed to create email draft: {str(e)}")
     finally:
-        if buffer:
-            buffer.close()
+        os.remove(path)
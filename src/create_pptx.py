@@ -1,182 +1,344 @@
 from pptx import Presentation
-from pptx.enum.text import PP_ALIGN
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from pptx.opc.package import Part
+from pptx.opc.packuri import PackURI
+from pptx.oxml.ns import qn
+from pptx.parts.slide import SlidePart
 from upload_file import upload_file
-from pathlib import Path
+from template_cache import template_cache
+from slide_cache import slide_cache
+from profiling import span
 import io
 import logging
-from typing import List, Dict, Any
+import os
+import re
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
 
 TITLE_LAYOUT = 2
 SECTION_LAYOUT = 7
 CONTENT_LAYOUT = 4
 
+# Load env. variables for parallel build of large presentations, 0 disables it
+PPTX_PARALLEL_MIN_SLIDES = int(os.environ.get("PPTX_PARALLEL_MIN_SLIDES", "200"))
+PPTX_PARALLEL_CHUNK_SLIDES = int(os.environ.get("PPTX_PARALLEL_CHUNK_SLIDES", "50"))
+
+# Line breaks and control characters, python-pptx converts them to a:br or escapes them
+SPECIAL_TEXT_PATTERN = re.compile(r"[\x00-\x08\x0A-\x1F]")
+
 # Create a logger
 logger = logging.getLogger(__name__)
 
-def load_templates():
-    """Loads presentation templates, returns None if not found"""
-    template_4_3 = Path("template_general_4_3.pptx")
-    template_16_9 = Path("template_general_16_9.pptx")
-    
-    # Check if templates exist
-    if template_4_3.exists() and template_16_9.exists():
-        return str(template_4_3), str(template_16_9)
-    else:
-        logger.warning("Template files not found, will use default PowerPoint templates")
-        return None, None
 
+class SlidePlan(NamedTuple):
+    """Layout of one slide type with the placeholders cloned to its slides"""
+    layout: Any
+    cloneable_placeholders: list
+    title_idx: Optional[int]
+    body_idx: Optional[int]
+
+
+def plan_slide(presentation, layout_index) -> SlidePlan:
+    """Resolves the layout of a slide type and its title and body placeholder indices"""
+    layout = presentation.slide_layouts[layout_index]
+    cloneable_placeholders = list(layout.iter_cloneable_placeholders())
+    indices = {placeholder.placeholder_format.idx for placeholder in cloneable_placeholders}
+
+    # Same placeholders as slide.placeholders[0] and [1] of a slide based on the layout
+    title_idx = 0 if 0 in indices else None
+    body_idx = 1 if 1 in indices and len(cloneable_placeholders) > 1 else None
+    return SlidePlan(layout, cloneable_placeholders, title_idx, body_idx)
+
+
+def fill_text(txBody, text: str):
+    """Replaces text of the text body, one paragraph per line (same as TextFrame.text)"""
+    txBody.clear_content()
+    for line in text.split("\n"):
+        txBody.add_p().append_text(line)
+
+
+def make_paragraph(txBody, text: str, level: int):
+    """Returns left aligned a:p element of given indentation level"""
+    p = txBody.makeelement(qn("a:p"))
+    pPr = p.makeelement(qn("a:pPr"), algn="l")
+    p.append(pPr)
+    if level:
+        # Validated by python-pptx, must be 0 to 8
+        pPr.lvl = level
+
+    if SPECIAL_TEXT_PATTERN.search(text):
+        p.append_text(text)
+    elif text:
+        r = p.makeelement(qn("a:r"))
+        t = r.makeelement(qn("a:t"))
+        t.text = text
+        r.append(t)
+        p.append(r)
+    return p
 
 class PowerpointPresentation:
 
-    def __init__(self, slides: List[Dict[str, Any]], format: str):
-        """Initialize PowerPoint presentation with slides and format"""
+    def __init__(self, slides: List[Dict[str, Any]], format: str, first_index: int = 0,
+                 slide_parts: Optional[List[Tuple[str, bytes]]] = None):
+        """Initialize PowerPoint presentation with slides and format.
+
+        A chunk of a larger deck passes the index of its first slide (used in error messages).
+        A deck built in chunks passes the slide parts of all chunks instead of slides.
+        """
 
         # Validate input
-        if not slides:
+        if not slides and slide_parts is None:
             raise ValueError("At least one slide is required")
 
-        # Loads templates
-        self.template_regular, self.template_wide = load_templates()
+        # Create presentation from the cached template based on the format used
+        if format == "4:3":
+            template_kind = "pptx_4_3"
+        elif format == "16:9":
+            template_kind = "pptx_16_9"
+        else:
+            logger.warning(f"Unknown format '{format}', defaulting to 4:3")
+            template_kind = "pptx_4_3"
 
-        # Create presentation based on the format used
-        try:
-            if format == "4:3":
-                if self.template_regular:
-                    self.presentation = Presentation(self.template_regular)
-                else:
-                    self.presentation = Presentation()  # Use default template
-            elif format == "16:9":
-                if self.template_wide:
-                    self.presentation = Presentation(self.template_wide)
-                else:
-                    self.presentation = Presentation()  # Use default template
-            else:
-                logger.warning(f"Unknown format '{format}', defaulting to 4:3")
-                if self.template_regular:
-                    self.presentation = Presentation(self.template_regular)
-                else:
-                    self.presentation = Presentation()  # Use default template
-        except Exception as e:
-            logger.error(f"Failed to load template: {e}")
-            logger.info("Falling back to default PowerPoint template")
-            self.presentation = Presentation()  # Fallback to default template
+        with span("pptx", "template"):
+            try:
+                # Identifies the template in the slide cache keys
+                self.template_fingerprint = template_cache.fingerprint(template_kind)
+                self.presentation = template_cache.get(template_kind)
+            except Exception as e:
+                logger.error(f"Failed to load template: {e}")
+                logger.info("Falling back to default PowerPoint template")
+                self.template_fingerprint = None
+                self.presentation = Presentation()  # Fallback to default template
 
-        # Remove default slide if it exists
-        if len(self.presentation.slides) > 0:
-            slide_to_remove = self.presentation.slides[0]
-            rId = self.presentation.slides.element.remove(slide_to_remove.element)
+        # Layouts and placeholders are resolved once per slide type, on first use
+        self.plans = {}
+        self.sldIdLst = self.presentation.part._element.get_or_add_sldIdLst()
+        self.next_slide_id = max([255] + [int(sldId.get("id")) for sldId in self.sldIdLst]) + 1
 
         # Create slides
-        self._create_slides(slides)
-
-    def _create_slides(self, slides: List[Dict[str, Any]]):
+        if slide_parts is not None:
+            with span("pptx", "assemble"):
+                self._add_slide_parts(slide_parts)
+        else:
+            with span("pptx", "build"):
+                self._create_slides(slides, first_index)
+
+    def _create_slides(self, slides: List[Dict[str, Any]], first_index: int = 0):
         """Create all slides from the slides data"""
-        for i, slide in enumerate(slides):
+        for i, slide in enumerate(slides, start=first_index):
             try:
                 slide_type = slide.get("slide_type")
 
-                if slide_type == "content":
-                    self.create_content_slide(slide)
-                elif slide_type == "section":
-                    self.create_section_slide(slide)
-                elif slide_type == "title":
-                    self.create_title_slide(slide)
-                else:
-                    logger.warning(f"Unknown slide type '{slide_type}' for slide {i}, skipping")
+                with span("pptx", f"{slide_type}_slide", metric=False):
+                    if slide_type == "content":
+                        self.create_content_slide(slide)
+                    elif slide_type == "section":
+                        self.create_section_slide(slide)
+                    elif slide_type == "title":
+                        self.create_title_slide(slide)
+                    else:
+                        logger.warning(f"Unknown slide type '{slide_type}' for slide {i}, skipping")
 
             except Exception as e:
                 logger.error(f"Failed to create slide {i}: {e}")
                 raise ValueError(f"Error creating slide {i}: {str(e)}")
 
+    def _get_plan(self, slide_type: str, layout_index: int) -> SlidePlan:
+        """Returns the slide plan of the slide type"""
+        plan = self.plans.get(slide_type)
+        if plan is None:
+            plan = self.plans[slide_type] = plan_slide(self.presentation, layout_index)
+        return plan
+
+    def _next_slide_partname(self) -> PackURI:
+        """Returns part name of the next slide"""
+        return PackURI("/ppt/slides/slide%d.xml" % (len(self.sldIdLst) + 1))
+
+    def _append_slide_part(self, slide_part: Part):
+        """Adds slide part to the end of the presentation"""
+        # Same as in slides.add_slide(), which looks for an existing relationship to the new
+        # slide and for the highest slide id on every call, so its cost grows with the deck
+        rId = self.presentation.part.rels._add_relationship(RT.SLIDE, slide_part)
+        self.sldIdLst._add_sldId(id=self.next_slide_id, rId=rId)
+        self.next_slide_id += 1
+
+    def _new_slide_part(self, plan: SlidePlan) -> SlidePart:
+        """Adds blank slide based on the planned layout to the presentation"""
+        slide_part = SlidePart.new(self._next_slide_partname(), self.presentation.part.package, plan.layout.part)
+        self._append_slide_part(slide_part)
+        return slide_part
+
+    def slide_parts(self) -> List[Tuple[str, bytes]]:
+        """Returns (layout part name, slide XML) of each slide, to be assembled into another deck"""
+        presentation_part = self.presentation.part
+        slide_parts = []
+        for sldId in self.sldIdLst:
+            slide_part = presentation_part.related_part(sldId.rId)
+            slide_parts.append((str(slide_part.part_related_by(RT.SLIDE_LAYOUT).partname), slide_part.blob))
+        return slide_parts
+
+    def _add_slide_parts(self, slide_parts: List[Tuple[str, bytes]]):
+        """Adds slides serialized by slide_parts(), linked to the layouts of this presentation"""
+        layout_parts = {layout.part.partname: layout.part for layout in self.presentation.slide_layouts}
+        package = self.presentation.part.package
+
+        for i, (layout_partname, blob) in enumerate(slide_parts):
+            layout_part = layout_parts.get(layout_partname)
+            if layout_part is None:
+                raise ValueError(f"Error creating slide {i}: layout {layout_partname} not found in the template")
+
+            # Kept as serialized XML, it is written to the file as is
+            slide_part = Part(self._next_slide_partname(), CT.PML_SLIDE, package, blob)
+            slide_part.relate_to(layout_part, RT.SLIDE_LAYOUT)
+            self._append_slide_part(slide_part)
+
+    def _add_slide(self, slide_type: str, layout_index: int, fill, *content):
+        """Adds slide of the slide type and fills its placeholders with fill(plan, text_bodies, *content).
+
+        A slide with the same content built before from the same template is cloned from
+        the slide cache instead.
+        """
+        plan = self._get_plan(slide_type, layout_index)
+        slide_part = self._new_slide_part(plan)
+
+        key = (self.template_fingerprint, slide_type, content)
+        if self.template_fingerprint is not None:
+            cached_spTree = slide_cache.get(key, slide_type)
+            if cached_spTree is not None:
+                spTree = slide_part._element.cSld.spTree
+                spTree.getparent().replace(spTree, cached_spTree)
+                return
+
+        shapes = slide_part.slide.shapes
+        for placeholder in plan.cloneable_placeholders:
+            shapes.clone_placeholder(placeholder)
+
+        # Text bodies of the placeholders by idx, found in one pass
+        fill(plan, {sp.ph_idx: sp.txBody for sp in shapes._spTree.iter_ph_elms()}, *content)
+
+        if self.template_fingerprint is not None:
+            slide_cache.put(key, shapes._spTree)
+
     def create_title_slide(self, slide: Dict[str, Any]):
         """Create a title slide"""
         try:
-            title_layout = self.presentation.slide_layouts[TITLE_LAYOUT]
-            title_slide = self.presentation.slides.add_slide(title_layout)
-
-            # Set title
-            if len(title_slide.placeholders) > 0:
-                title_slide.placeholders[0].text = slide.get("slide_title", "")
-
-            # Set author
-            if len(title_slide.placeholders) > 1:
-                title_slide.placeholders[1].text = slide.get("author", "")
+            self._add_slide(
+                "title", TITLE_LAYOUT, self._fill_title_slide, slide.get("slide_title", ""), slide.get("author", "")
+            )
 
         except Exception as e:
             logger.error(f"Failed to create title slide: {e}")
             raise
 
+    def _fill_title_slide(self, plan: SlidePlan, text_bodies, title: str, author: str):
+        """Fills placeholders of a title slide"""
+        # Set title
+        if plan.title_idx is not None:
+            fill_text(text_bodies[plan.title_idx], title)
+
+        # Set author
+        if plan.body_idx is not None:
+            fill_text(text_bodies[plan.body_idx], author)
+
     def create_section_slide(self, slide: Dict[str, Any]):
         """Create a section slide"""
         try:
-            section_layout = self.presentation.slide_layouts[SECTION_LAYOUT]
-            section_slide = self.presentation.slides.add_slide(section_layout)
-
-            # Set title
-            if len(section_slide.placeholders) > 0:
-                section_slide.placeholders[0].text = slide.get("slide_title", "")
+            self._add_slide("section", SECTION_LAYOUT, self._fill_section_slide, slide.get("slide_title", ""))
 
         except Exception as e:
             logger.error(f"Failed to create section slide: {e}")
             raise
 
+    def _fill_section_slide(self, plan: SlidePlan, text_bodies, title: str):
+        """Fills placeholders of a section slide"""
+        # Set title
+        if plan.title_idx is not None:
+            fill_text(text_bodies[plan.title_idx], title)
+
     def create_content_slide(self, slide: Dict[str, Any]):
         """Create a content slide with bullet points"""
         try:
-            content_layout = self.presentation.slide_layouts[CONTENT_LAYOUT]
-            content_slide = self.presentation.slides.add_slide(content_layout)
-
-            # Set title
-            if len(content_slide.placeholders) > 0:
-                content_slide.placeholders[0].text = slide.get("slide_title", "")
-
-            # Add content
-            slide_text = slide.get("slide_text", [])
-            if slide_text and len(content_slide.placeholders) > 1:
-                # Clear existing text
-                content_slide.placeholders[1].text = ""
-
-                # Add first paragraph
-                first_item = slide_text[0]
-                content_slide.placeholders[1].text_frame.paragraphs[0].text = first_item.get("text", "")
-                content_slide.placeholders[1].text_frame.paragraphs[0].alignment = PP_ALIGN.LEFT
-                content_slide.placeholders[1].text_frame.paragraphs[0].level = max(0, int(first_item.get("indentation_level", 1)) - 1)
-
-                # Add remaining paragraphs
-                for paragraph_data in slide_text[1:]:
-                    p = content_slide.placeholders[1].text_frame.add_paragraph()
-                    p.text = paragraph_data.get("text", "")
-                    p.alignment = PP_ALIGN.LEFT
-                    p.level = max(0, int(paragraph_data.get("indentation_level", 1)) - 1)
+            # Bullets normalized to (text, level), so equal slides share the slide cache entry
+            bullets = tuple(
+                (paragraph_data.get("text", ""), max(0, int(paragraph_data.get("indentation_level", 1)) - 1))
+                for paragraph_data in slide.get("slide_text", [])
+            )
+            self._add_slide("content", CONTENT_LAYOUT, self._fill_content_slide, slide.get("slide_title", ""), bullets)
 
         except Exception as e:
             logger.error(f"Failed to create content slide: {e}")
             raise
 
+    def _fill_content_slide(self, plan: SlidePlan, text_bodies, title: str, bullets):
+        """Fills placeholders of a content slide"""
+        # Set title
+        if plan.title_idx is not None:
+            fill_text(text_bodies[plan.title_idx], title)
+
+        # Add content, all paragraphs are built first and inserted at once
+        if bullets and plan.body_idx is not None:
+            txBody = text_bodies[plan.body_idx]
+            paragraphs = [make_paragraph(txBody, text, level) for text, level in bullets]
+            txBody.clear_content()
+            txBody.extend(paragraphs)
+
     def save(self) -> io.BytesIO:
         """Save presentation to BytesIO object"""
         try:
-            file_like_object = io.BytesIO()
-            self.presentation.save(file_like_object)
-            file_like_object.seek(0)
+            with span("pptx", "serialize"):
+                file_like_object = io.BytesIO()
+                self.presentation.save(file_like_object)
+                file_like_object.seek(0)
             return file_like_object
         except Exception as e:
             logger.error(f"Failed to save presentation: {e}")
             raise
 
+def build_presentation(slides: List[Dict[str, Any]], format: str = "4:3") -> io.BytesIO:
+    """Builds new presentation and returns it as BytesIO object."""
+
+    # Validate input
+    if not slides:
+        raise ValueError("No slides provided")
+
+    # Create presentation
+    presentation = PowerpointPresentation(slides, format)
+
+    # Save presentation
+    return presentation.save()
+
+def split_slides(slides: List[Dict[str, Any]], workers: int) -> List[Tuple[int, List[Dict[str, Any]]]]:
+    """Splits large presentation into chunks built in parallel.
+
+    :return: List of (index of the first slide, slides) chunks, a single chunk if the
+        presentation has less than PPTX_PARALLEL_MIN_SLIDES slides
+    """
+    if not PPTX_PARALLEL_MIN_SLIDES or len(slides) < PPTX_PARALLEL_MIN_SLIDES or workers < 2:
+        return [(0, slides)]
+
+    # At least PPTX_PARALLEL_CHUNK_SLIDES slides per chunk, each chunk copies the template
+    count = max(1, min(workers, len(slides) // max(1, PPTX_PARALLEL_CHUNK_SLIDES)))
+    size = -(-len(slides) // count)
+    return [(start, slides[start:start + size]) for start in range(0, len(slides), size)]
+
+def build_slide_parts(slides: List[Dict[str, Any]], format: str = "4:3", first_index: int = 0) -> List[Tuple[str, bytes]]:
+    """Builds chunk of a presentation and returns its slide parts for assemble_presentation()."""
+
+    presentation = PowerpointPresentation(slides, format, first_index=first_index)
+    with span("pptx", "serialize"):
+        return presentation.slide_parts()
+
+def assemble_presentation(slide_parts: List[Tuple[str, bytes]], format: str = "4:3") -> io.BytesIO:
+    """Assembles presentation from slide parts of all chunks and returns it as BytesIO object."""
+
+    presentation = PowerpointPresentation([], format, slide_parts=slide_parts)
+    return presentation.save()
+
 def create_presentation(slides: List[Dict[str, Any]], format: str = "4:3") -> str:
     """Creates new presentation."""
 
     try:
-        # Validate input
-        if not slides:
-            raise ValueError("No slides provided")
-
-        # Create presentation
-        presentation = PowerpointPresentation(slides, format)
-
-        # Save presentation
-        file_object = presentation.save()
+        # Build presentation
+        file_object = build_presentation(slides, format)
 
         # Upload presentation
         text = upload_file(file_object, "pptx")
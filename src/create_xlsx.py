@@ -1,45 +1,29 @@
 from os.path import exists
+from bisect import bisect_right
+from copy import copy
 import re
 from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.styles.borders import DEFAULT_BORDER
+from openpyxl.styles.fills import DEFAULT_EMPTY_FILL
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 from pathlib import Path
+from upload_file import upload_file
+from profiling import span
+from markdown_blocks import iter_blocks, iter_table_rows, HEADING, TABLE
+import io
+import os
+
+# Markdown with at least this many table rows is converted in write-only streaming mode, 0 disables it
+EXCEL_STREAMING_MIN_ROWS = int(os.environ.get("EXCEL_STREAMING_MIN_ROWS", "0"))
 
 def load_template():
     """Loads Excel template if available"""
     # No Excel template exists in the project, so always return None
     return None
 
-def parse_table(lines, start_idx):
-    """Parse markdown table and return the table data and next line index"""
-    table_lines = []
-    i = start_idx
-
-    # Find all table lines
-    while i < len(lines):
-        line = lines[i].strip()
-        if line.startswith('|') and line.endswith('|'):
-            table_lines.append(line)
-            i += 1
-        else:
-            break
-
-    if len(table_lines) < 2:  # Need at least header and separator
-        return None, start_idx + 1
-
-    # Parse table data
-    table_data = []
-    for line in table_lines:
-        # Skip separator line (contains dashes)
-        if '---' in line or ':-:' in line or ':--' in line or '--:' in line:
-            continue
-
-        # Split by | and clean up
-        cells = [cell.strip() for cell in line.split('|')[1:-1]]  # Remove empty first/last
-        table_data.append(cells)
-
-    return table_data, i
-
 def format_cell_value(value):
     """Convert string value to appropriate Excel type (number, text, formula, etc.)"""
     value = value.strip()
@@ -80,153 +64,201 @@ def parse_cell_formatting(cell_text):
     
     return clean_text, formatting_info
 
-def apply_cell_formatting(cell, formatting_info):
-    """Apply formatting information to an Excel cell"""
-    current_font = cell.font
-    
-    if formatting_info['bold']:
-        cell.font = Font(bold=True, color=current_font.color, size=current_font.size)
-    elif formatting_info['italic']:
-        cell.font = Font(italic=True, color=current_font.color, size=current_font.size)
-    elif formatting_info['monospace']:
-        cell.font = Font(name='Courier New', color=current_font.color, size=current_font.size)
+# Styles of table cells, registered as named styles in the workbook on first use
+TABLE_BORDER = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
+HEADER_FILL = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+FORMULA_FILL = PatternFill(start_color="E7F3FF", end_color="E7F3FF", fill_type="solid")  # Light blue background for formulas
+
+NAMED_STYLES = {
+    "header": {"font": Font(bold=True, color="FFFFFF"), "fill": HEADER_FILL,
+               "alignment": Alignment(horizontal='center'), "border": TABLE_BORDER},
+    "text": {"alignment": Alignment(horizontal='left'), "border": TABLE_BORDER},
+    "number": {"alignment": Alignment(horizontal='right'), "border": TABLE_BORDER},
+    # Decimal between 0 and 1
+    "percentage": {"alignment": Alignment(horizontal='right'), "border": TABLE_BORDER, "number_format": '0.00%'},
+    # Large numbers with thousands separator
+    "thousands": {"alignment": Alignment(horizontal='right'), "border": TABLE_BORDER, "number_format": '#,##0'},
+    "formula": {"alignment": Alignment(horizontal='right'), "border": TABLE_BORDER, "fill": FORMULA_FILL},
+    "heading 1": {"font": Font(size=16, bold=True, color="2F5597")},
+    "heading 2": {"font": Font(size=14, bold=True, color="4472C4")},
+    "heading 3": {"font": Font(size=12, bold=True)},
+}
+
+# Fonts for markdown formatting (bold, italic, code) in cells
+EMPHASIS_FONTS = {
+    "bold": Font(bold=True, color=DEFAULT_FONT.color, size=DEFAULT_FONT.size),
+    "italic": Font(italic=True, color=DEFAULT_FONT.color, size=DEFAULT_FONT.size),
+    "monospace": Font(name='Courier New', color=DEFAULT_FONT.color, size=DEFAULT_FONT.size),
+}
+
+class ExcelStyleRegistry:
+    """Builds each distinct cell style once per workbook as a named style.
+
+    Cells get a copy of the style array of the named style, so openpyxl does not have
+    to create and deduplicate new Font/Alignment/PatternFill objects for every cell.
+    """
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._styles = {}
+
+    def get(self, role, emphasis=None):
+        """Returns style array of the named style for given role and markdown formatting"""
+        if role == "header":
+            # Header cells keep the white bold header font whatever their formatting
+            emphasis = None
+        key = (role, emphasis)
+        style_array = self._styles.get(key)
+        if style_array is None:
+            style_array = self._styles[key] = self._named_style(role, emphasis).as_tuple()
+        return style_array
+
+    def _named_style(self, role, emphasis):
+        """Returns the named style, added to the workbook unless it already has one of that name"""
+        name = f"Markdown {role.title()}"
+        if emphasis:
+            name += f" {emphasis.title()}"
+        # Added by an earlier registry of the same workbook or present in a loaded workbook
+        if name in self.workbook.named_styles:
+            return self.workbook._named_styles[name]
+
+        attributes = {"font": DEFAULT_FONT, "border": DEFAULT_BORDER, "fill": DEFAULT_EMPTY_FILL, "alignment": Alignment()}
+        attributes.update(NAMED_STYLES[role])
+        if emphasis:
+            attributes["font"] = EMPHASIS_FONTS[emphasis]
+
+        style = NamedStyle(name=name, **attributes)
+        self.workbook.add_named_style(style)
+        return style
+
+    def apply(self, cell, role, emphasis=None):
+        """Assigns the named style to the cell (same as cell.style = name, without name lookup)"""
+        cell._style = copy(self.get(role, emphasis))
+
+# Single pattern for all row-relative references, alternatives are tried in this order:
+# table function T1.SUM(B[0]:E[0]), table reference T1.B[1] and current table reference B[0].
+# Ranges like B[0]:E[0] or T1.B[0]:T1.E[0] are rewritten as two separate references.
+FORMULA_REFERENCE_PATTERN = re.compile(
+    r'T(\d+)\.(SUM|AVERAGE|MAX|MIN)\(([A-Z]+)\[([+-]?\d+)\]:([A-Z]+)\[([+-]?\d+)\]\)'
+    r'|T(\d+)\.([A-Z]+)\[([+-]?\d+)\]'
+    r'|([A-Z]+)\[([+-]?\d+)\]'
+)
+
+class FormulaRewriter:
+    """Converts row-relative references [offset] and table references T1.B[1] to actual Excel row numbers.
+
+    Each distinct formula is tokenized once per table, the result is a template of text
+    parts and references. A reference is either resolved to a fixed row, or (if the
+    table is unknown) relative to the current row, so for each cell only integer
+    offsets are substituted.
+    """
+
+    def __init__(self, table_positions=None):
+        self.table_positions = table_positions if table_positions is not None else {}
+        self._table_starts = []
+        self._indexed_tables = -1
+        self._templates = {}
+
+    def _current_table_start(self, current_excel_row):
+        """Find start row of the table containing current row using bisect over table start rows"""
+        if self._indexed_tables != len(self.table_positions):
+            # Tables were added since last call, rebuild index and drop templates
+            # that could reference them
+            self._table_starts = sorted(self.table_positions.values())
+            self._indexed_tables = len(self.table_positions)
+            self._templates.clear()
+
+        index = bisect_right(self._table_starts, current_excel_row)
+        return self._table_starts[index - 1] if index else None
+
+    def _table_row(self, table_num, offset):
+        """Returns fixed row in given table, None if the table is unknown"""
+        table_start_row = self.table_positions.get(f"T{table_num}")
+        if table_start_row is None:
+            return None
+        # Add 1 to skip header row, then add offset
+        return table_start_row + 1 + offset
+
+    def _compile(self, formula, current_table_start):
+        """Tokenize formula into template of text parts and (column, fixed row, offset) references"""
+        parts = []
+        position = 0
+
+        def add_reference(column, row, offset):
+            # Fixed row if known, otherwise relative to the current row
+            if row is None:
+                parts.append((column, None, offset))
+            else:
+                parts.append(f"{column}{row}")
+
+        for match in FORMULA_REFERENCE_PATTERN.finditer(formula):
+            parts.append(formula[position:match.start()])
+            position = match.end()
+
+            if match.group(1) is not None:
+                # Table function like T1.SUM(B[0]:E[0])
+                table_num = int(match.group(1))
+                start_offset = int(match.group(4))
+                end_offset = int(match.group(6))
+                parts.append(f"{match.group(2)}(")
+                add_reference(match.group(3), self._table_row(table_num, start_offset), start_offset)
+                parts.append(":")
+                add_reference(match.group(5), self._table_row(table_num, end_offset), end_offset)
+                parts.append(")")
+
+            elif match.group(7) is not None:
+                # Table reference like T1.B[1], falls back to current row if table not found
+                offset = int(match.group(9))
+                add_reference(match.group(8), self._table_row(int(match.group(7)), offset), offset)
+
+            else:
+                # Reference to the current table, calculated from the start of the table
+                offset = int(match.group(11))
+                row = current_table_start + 1 + offset if current_table_start is not None else None
+                add_reference(match.group(10), row, offset)
+
+        parts.append(formula[position:])
+
+        # Join neighbouring text parts
+        template = []
+        for part in parts:
+            if isinstance(part, str) and template and isinstance(template[-1], str):
+                template[-1] += part
+            elif part != "":
+                template.append(part)
+
+        if len(template) == 1 and isinstance(template[0], str):
+            return template[0]
+        return tuple(template)
+
+    def rewrite(self, formula, current_excel_row):
+        """Returns formula with all references converted to Excel rows"""
+        if not formula.startswith('='):
+            return formula
+
+        current_table_start = self._current_table_start(current_excel_row)
+        key = (formula, current_table_start)
+        template = self._templates.get(key)
+        if template is None:
+            template = self._compile(formula, current_table_start)
+            self._templates[key] = template
+
+        if isinstance(template, str):
+            return template
+
+        return "".join(
+            part if isinstance(part, str) else f"{part[0]}{current_excel_row + part[2]}"
+            for part in template
+        )
 
 def adjust_formula_references(formula, current_excel_row, table_positions=None):
     """Convert row-relative references [offset] and table references T1.B[1] to actual Excel row numbers"""
-    if not formula.startswith('='):
-        return formula
-
-    if table_positions is None:
-        table_positions = {}
-
-    # First handle table-based references like T1.B[1], T2.SUM(C[0]:F[0])
-    table_pattern = r'T(\d+)\.([A-Z]+)\[([+-]?\d+)\]'
-
-    def replace_table_reference(match):
-        table_num = int(match.group(1))
-        column = match.group(2)
-        offset = int(match.group(3))
-
-        # Get the starting row of the specified table
-        table_key = f"T{table_num}"
-        if table_key in table_positions:
-            table_start_row = table_positions[table_key]
-            # Add 1 to skip header row, then add offset
-            actual_row = table_start_row + 1 + offset
-            return f"{column}{actual_row}"
-        else:
-            # Fallback to current table if table not found
-            actual_row = current_excel_row + offset
-            return f"{column}{actual_row}"
-
-    # Replace table-based cell references
-    adjusted_formula = re.sub(table_pattern, replace_table_reference, formula)
-
-    # Handle table-based range references like T1.B[0]:T1.E[0]
-    table_range_pattern = r'T(\d+)\.([A-Z]+)\[([+-]?\d+)\]:T(\d+)\.([A-Z]+)\[([+-]?\d+)\]'
-
-    def replace_table_range(match):
-        start_table_num = int(match.group(1))
-        start_col = match.group(2)
-        start_offset = int(match.group(3))
-        end_table_num = int(match.group(4))
-        end_col = match.group(5)
-        end_offset = int(match.group(6))
-
-        # Get starting rows for both tables
-        start_table_key = f"T{start_table_num}"
-        end_table_key = f"T{end_table_num}"
-
-        if start_table_key in table_positions:
-            start_table_row = table_positions[start_table_key]
-            start_row = start_table_row + 1 + start_offset
-        else:
-            start_row = current_excel_row + start_offset
-
-        if end_table_key in table_positions:
-            end_table_row = table_positions[end_table_key]
-            end_row = end_table_row + 1 + end_offset
-        else:
-            end_row = current_excel_row + end_offset
-
-        return f"{start_col}{start_row}:{end_col}{end_row}"
-
-    adjusted_formula = re.sub(table_range_pattern, replace_table_range, adjusted_formula)
-
-    # Handle simplified table range references like T1.SUM(B[0]:E[0])
-    table_func_pattern = r'T(\d+)\.(SUM|AVERAGE|MAX|MIN)\(([A-Z]+)\[([+-]?\d+)\]:([A-Z]+)\[([+-]?\d+)\]\)'
-
-    def replace_table_function(match):
-        table_num = int(match.group(1))
-        func_name = match.group(2)
-        start_col = match.group(3)
-        start_offset = int(match.group(4))
-        end_col = match.group(5)
-        end_offset = int(match.group(6))
-
-        table_key = f"T{table_num}"
-        if table_key in table_positions:
-            table_start_row = table_positions[table_key]
-            start_row = table_start_row + 1 + start_offset
-            end_row = table_start_row + 1 + end_offset
-        else:
-            start_row = current_excel_row + start_offset
-            end_row = current_excel_row + end_offset
-
-        return f"{func_name}({start_col}{start_row}:{end_col}{end_row})"
-
-    adjusted_formula = re.sub(table_func_pattern, replace_table_function, adjusted_formula)
-
-    # Find the current table's start row for relative references
-    current_table_start = None
-    for table_key, table_start_row in table_positions.items():
-        # Check if current_excel_row falls within this table's range
-        # We need to find which table contains the current row
-        if table_start_row <= current_excel_row:
-            current_table_start = table_start_row
-
-    # Finally, handle regular row-relative references [offset] for current table
-    pattern = r'([A-Z]+)\[([+-]?\d+)\]'
-
-    def replace_reference(match):
-        column = match.group(1)
-        offset = int(match.group(2))
-
-        # Calculate from the start of the current table, not the current row
-        if current_table_start is not None:
-            actual_row = current_table_start + 1 + offset  # +1 to skip header
-        else:
-            # Fallback to old behavior if we can't determine table start
-            actual_row = current_excel_row + offset
-
-        return f"{column}{actual_row}"
-
-    # Replace all remaining row-relative references
-    adjusted_formula = re.sub(pattern, replace_reference, adjusted_formula)
-
-    # Handle regular range references like B[0]:E[0] (within current table)
-    range_pattern = r'([A-Z]+)\[([+-]?\d+)\]:([A-Z]+)\[([+-]?\d+)\]'
-
-    def replace_range(match):
-        start_col = match.group(1)
-        start_offset = int(match.group(2))
-        end_col = match.group(3)
-        end_offset = int(match.group(4))
-
-        # Calculate from the start of the current table, not the current row
-        if current_table_start is not None:
-            start_row = current_table_start + 1 + start_offset  # +1 to skip header
-            end_row = current_table_start + 1 + end_offset
-        else:
-            # Fallback to old behavior if we can't determine table start
-            start_row = current_excel_row + start_offset
-            end_row = current_excel_row + end_offset
-
-        return f"{start_col}{start_row}:{end_col}{end_row}"
-
-    adjusted_formula = re.sub(range_pattern, replace_range, adjusted_formula)
-
-    return adjusted_formula
+    return FormulaRewriter(table_positions).rewrite(formula, current_excel_row)
 
 def detect_formula_pattern(value):
     """Detect common formula patterns in markdown and convert to Excel formulas"""
@@ -254,21 +286,56 @@ def detect_formula_pattern(value):
 
     return value
 
-def add_table_to_sheet(table_data, worksheet, start_row, table_positions=None):
+def get_cell_role(value, is_header):
+    """Returns named style role of table cell based on its value"""
+    if is_header:
+        return "header"
+    if isinstance(value, str):
+        return "formula" if value.startswith('=') else "text"
+    if isinstance(value, float) and 0 <= value <= 1 and not value == 0:
+        return "percentage"
+    if value >= 1000:
+        return "thousands"
+    return "number"
+
+def get_cell_emphasis(formatting_info):
+    """Returns markdown formatting of the cell (bold, italic or monospace), None if not formatted"""
+    for emphasis in ("bold", "italic", "monospace"):
+        if formatting_info[emphasis]:
+            return emphasis
+    return None
+
+def convert_table_cell(cell_text, current_excel_row, formula_rewriter, is_header):
+    """Returns Excel value, named style role and markdown emphasis of a markdown table cell"""
+    # First, parse markdown formatting to get clean text and formatting info
+    clean_text, formatting_info = parse_cell_formatting(cell_text)
+
+    # Detect and format formulas using the clean text
+    formula_value = detect_formula_pattern(clean_text)
+
+    # Format cell value (convert numbers, percentages, formulas)
+    if formula_value.startswith('='):
+        # Adjust row-relative references to actual Excel rows
+        value = formula_rewriter.rewrite(formula_value, current_excel_row)
+    else:
+        value = format_cell_value(clean_text)
+
+    return value, get_cell_role(value, is_header), get_cell_emphasis(formatting_info)
+
+def get_column_width(max_length):
+    """Returns column width for the longest cell text"""
+    return min(max(max_length + 2, 12), 25)  # Min 12, max 25 characters
+
+def add_table_to_sheet(table_data, worksheet, start_row, table_positions=None, formula_rewriter=None, style_registry=None):
     """Add table data to Excel worksheet with proper formatting and formula support"""
     if not table_data:
         return start_row
 
-    # Style definitions
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    formula_fill = PatternFill(start_color="E7F3FF", end_color="E7F3FF", fill_type="solid")
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    # Reuse rewriter of the workbook so formula templates are shared between tables
+    if formula_rewriter is None:
+        formula_rewriter = FormulaRewriter(table_positions)
+    if style_registry is None:
+        style_registry = ExcelStyleRegistry(worksheet.parent)
 
     # Add table data
     for row_idx, row_data in enumerate(table_data):
@@ -276,46 +343,9 @@ def add_table_to_sheet(table_data, worksheet, start_row, table_positions=None):
 
         for col_idx, cell_text in enumerate(row_data):
             cell = worksheet.cell(row=current_excel_row, column=col_idx + 1)
-
-            # First, parse markdown formatting to get clean text and formatting info
-            clean_text, formatting_info = parse_cell_formatting(cell_text)
-
-            # Detect and format formulas using the clean text
-            formula_value = detect_formula_pattern(clean_text)
-
-            # Format cell value (convert numbers, percentages, formulas)
-            if formula_value.startswith('='):
-                # Adjust row-relative references to actual Excel rows
-                adjusted_formula = adjust_formula_references(formula_value, current_excel_row, table_positions)
-                cell.value = adjusted_formula
-                cell.fill = formula_fill  # Light blue background for formulas
-            else:
-                formatted_value = format_cell_value(clean_text)
-                cell.value = formatted_value
-
-            # Apply markdown formatting (bold, italic, code) if any was detected
-            apply_cell_formatting(cell, formatting_info)
-
-            cell.border = border
-
-            # Set alignment
-            if row_idx == 0:
-                cell.alignment = Alignment(horizontal='center')
-            elif isinstance(cell.value, (int, float)) or (isinstance(cell.value, str) and cell.value.startswith('=')):
-                cell.alignment = Alignment(horizontal='right')
-            else:
-                cell.alignment = Alignment(horizontal='left')
-
-            # Style header row
-            if row_idx == 0:
-                cell.font = header_font
-                cell.fill = header_fill
-            elif isinstance(cell.value, float) and 0 <= cell.value <= 1 and not cell.value == 0:
-                # Format as percentage if it's a decimal between 0 and 1
-                cell.number_format = '0.00%'
-            elif isinstance(cell.value, (int, float)) and cell.value >= 1000:
-                # Format large numbers with thousands separator
-                cell.number_format = '#,##0'
+            value, role, emphasis = convert_table_cell(cell_text, current_excel_row, formula_rewriter, row_idx == 0)
+            cell.value = value
+            style_registry.apply(cell, role, emphasis)
 
     # Auto-adjust column widths
     for col_idx in range(len(table_data[0]) if table_data else 0):
@@ -324,27 +354,140 @@ def add_table_to_sheet(table_data, worksheet, start_row, table_positions=None):
         for row in table_data:
             if col_idx < len(row):
                 max_length = max(max_length, len(str(row[col_idx])))
-        adjusted_width = min(max(max_length + 2, 12), 25)  # Min 12, max 25 characters
-        worksheet.column_dimensions[column_letter].width = adjusted_width
+        worksheet.column_dimensions[column_letter].width = get_column_width(max_length)
 
     return start_row + len(table_data) + 2  # Return next available row with spacing
 
-def markdown_to_excel(markdown_content):
-    """Convert Markdown to Excel workbook (focused on tables and headers)."""
-    template_path = load_template()
+def scan_sheet_layout(lines):
+    """First pass of the streaming mode, finds positions of headers and tables without keeping any cells.
 
-    # Create workbook
-    if template_path:
-        try:
-            wb = load_workbook(template_path)
-            ws = wb.active
-        except Exception as e:
-            print(f"Warning: Could not load template {template_path}: {e}")
+    :return: List of (row, block) for headers and tables, table positions and column widths by column index
+    """
+    blocks = []
+    table_positions = {}
+    column_widths = {}
+    current_row = 1
+
+    for block in iter_blocks(lines):
+
+        # Headers
+        if block.kind == HEADING:
+            blocks.append((current_row, block))
+            current_row += 2  # Add space after headers
+
+        # Tables
+        elif block.kind == TABLE:
+            row_count = 0
+            column_count = 0
+            max_lengths = {}
+            for cells in iter_table_rows(lines, block.start, block.end):
+                if row_count == 0:
+                    column_count = len(cells)
+                row_count += 1
+                for col_idx, cell_text in enumerate(cells):
+                    max_lengths[col_idx] = max(max_lengths.get(col_idx, 0), len(cell_text))
+
+            if row_count:
+                table_positions[f"T{len(table_positions) + 1}"] = current_row
+                blocks.append((current_row, block))
+                # Later tables override widths of earlier ones, as in the regular mode
+                for col_idx in range(column_count):
+                    column_widths[col_idx] = get_column_width(max_lengths.get(col_idx, 0))
+                current_row += row_count + 2  # Add space after tables
+
+        # Skip empty lines and other content
+
+    return blocks, table_positions, column_widths
+
+def build_excel_streaming(markdown_content):
+    """Convert Markdown to Excel workbook using write-only mode and return it as BytesIO object.
+
+    The layout is computed in a first pass over the lines, then the rows are written one
+    by one, so memory does not grow with the number of cells. As in the regular mode,
+    formulas refer only to tables written before them, so both modes give the same cells.
+    """
+    with span("xlsx", "parse"):
+        lines = markdown_content.split('\n')
+        blocks, table_positions, column_widths = scan_sheet_layout(lines)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Data Report")
+    written_positions = {}  # Positions of tables written so far
+    formula_rewriter = FormulaRewriter(written_positions)
+    style_registry = ExcelStyleRegistry(wb)
+
+    # Column widths must be set before the first row is written
+    for col_idx, width in column_widths.items():
+        ws.column_dimensions[get_column_letter(col_idx + 1)].width = width
+
+    def styled_cell(value, role, emphasis=None):
+        cell = WriteOnlyCell(ws, value=value)
+        style_registry.apply(cell, role, emphasis)
+        return cell
+
+    try:
+        with span("xlsx", "build"):
+            next_row = 1
+            for row, block in blocks:
+                # Rows are written in order, fill the space between blocks with empty rows
+                while next_row < row:
+                    ws.append([])
+                    next_row += 1
+
+                if block.kind == HEADING:
+                    ws.append([styled_cell(block.text, f"heading {min(block.level, 3)}")])
+                    next_row += 1
+                else:
+                    table_key = f"T{len(written_positions) + 1}"
+                    written_positions[table_key] = table_positions[table_key]
+                    for row_idx, row_data in enumerate(iter_table_rows(lines, block.start, block.end)):
+                        ws.append(
+                            styled_cell(*convert_table_cell(cell_text, next_row, formula_rewriter, row_idx == 0))
+                            for cell_text in row_data
+                        )
+                        next_row += 1
+
+    except Exception as e:
+        print(f"Error in parsing markdown: {e}")
+        import traceback
+        traceback.print_exc()
+        raise ValueError(f"Error in parsing markdown: {e}") from e
+
+    # Save the workbook to BytesIO object
+    with span("xlsx", "serialize"):
+        file_object = io.BytesIO()
+        wb.save(file_object)
+        file_object.seek(0)
+    return file_object
+
+def build_excel(markdown_content, streaming=None):
+    """Convert Markdown to Excel workbook (focused on tables and headers) and return it as BytesIO object.
+
+    :param streaming: Use write-only streaming mode, by default only for markdown with
+                      at least EXCEL_STREAMING_MIN_ROWS table rows (if set)
+    """
+    if streaming is None:
+        streaming = EXCEL_STREAMING_MIN_ROWS > 0 and sum(
+            1 for line in markdown_content.split('\n') if line.lstrip().startswith('|')
+        ) >= EXCEL_STREAMING_MIN_ROWS
+    if streaming:
+        return build_excel_streaming(markdown_content)
+
+    with span("xlsx", "template"):
+        template_path = load_template()
+
+        # Create workbook
+        if template_path:
+            try:
+                wb = load_workbook(template_path)
+                ws = wb.active
+            except Exception as e:
+                print(f"Warning: Could not load template {template_path}: {e}")
+                wb = Workbook()
+                ws = wb.active
+        else:
             wb = Workbook()
             ws = wb.active
-    else:
-        wb = Workbook()
-        ws = wb.active
 
     # Set worksheet title
     ws.title = "Data Report"
@@ -354,69 +497,63 @@ def markdown_to_excel(markdown_content):
     current_row = 1
     table_counter = 1
     table_positions = {}  # Track where each table starts
-    i = 0
+    formula_rewriter = FormulaRewriter(table_positions)
+    style_registry = ExcelStyleRegistry(wb)
 
     try:
-        while i < len(lines):
-            line = lines[i].strip()
-
-            # Skip empty lines
-            if not line:
-                i += 1
-                continue
-
-            # Headers
-            if line.startswith('#'):
-                header_level = len(line) - len(line.lstrip('#'))
-                header_text = line.lstrip('#').strip()
-
-                cell = ws.cell(row=current_row, column=1)
-                cell.value = header_text
-
-                # Style headers based on level
-                if header_level == 1:
-                    cell.font = Font(size=16, bold=True, color="2F5597")
-                elif header_level == 2:
-                    cell.font = Font(size=14, bold=True, color="4472C4")
-                else:
-                    cell.font = Font(size=12, bold=True)
+        with span("xlsx", "parse"):
+            blocks = list(iter_blocks(lines))
 
-                current_row += 2  # Add space after headers
-                i += 1
+        with span("xlsx", "build"):
+            for block in blocks:
 
-            # Tables
-            elif line.startswith('|'):
-                table_data, i = parse_table(lines, i)
-                if table_data:
-                    # Record this table's position
-                    table_key = f"T{table_counter}"
-                    table_positions[table_key] = current_row
+                # Headers
+                if block.kind == HEADING:
+                    cell = ws.cell(row=current_row, column=1)
+                    cell.value = block.text
 
-                    # Process the table
-                    current_row = add_table_to_sheet(table_data, ws, current_row, table_positions)
-                    table_counter += 1
+                    # Style headers based on level
+                    style_registry.apply(cell, f"heading {min(block.level, 3)}")
 
-            # Skip other content
-            else:
-                i += 1
+                    current_row += 2  # Add space after headers
+
+                # Tables
+                elif block.kind == TABLE:
+                    table_data = list(iter_table_rows(lines, block.start, block.end))
+                    if table_data:
+                        # Record this table's position
+                        table_key = f"T{table_counter}"
+                        table_positions[table_key] = current_row
+
+                        # Process the table
+                        with span("xlsx", "table", metric=False):
+                            current_row = add_table_to_sheet(table_data, ws, current_row, table_positions, formula_rewriter, style_registry)
+                        table_counter += 1
+
+                # Skip other content
 
     except Exception as e:
         print(f"Error in parsing markdown: {e}")
         import traceback
         traceback.print_exc()
-        return f"Error in parsing markdown: {e}"
-
-    # Save the workbook to BytesIO and upload
-    try:
-        from upload_file import upload_file
-        import io
+        raise ValueError(f"Error in parsing markdown: {e}") from e
 
-        # Save to BytesIO object
+    # Save the workbook to BytesIO object
+    with span("xlsx", "serialize"):
         file_object = io.BytesIO()
         wb.save(file_object)
         file_object.seek(0)
+    return file_object
 
-        # Upload and get result
+def markdown_to_excel(markdown_content):
+    """Convert Markdown to Excel workbook (focused on tables and headers)."""
+    try:
+        file_object = build_excel(markdown_content)
+    except ValueError as e:
+        return str(e)
+
+    # Upload the workbook
+    try:
         result = upload_file(file_object, "xlsx")
         file_object.close()
 
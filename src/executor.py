@@ -0,0 +1,299 @@
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from metrics import registry, run_captured, replay
+from profiling import profiled
+from startup import import_modules
+from supervisor import WEB_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Load env. variables for the executor layer
+EXECUTOR_MODE = os.environ.get("EXECUTOR_MODE", "process")
+# Each server worker has its own build pool, together they default to the number of CPU cores
+BUILD_WORKERS = int(os.environ.get("BUILD_WORKERS", max(1, (os.cpu_count() or 1) // WEB_WORKERS)))
+UPLOAD_THREADS = int(os.environ.get("UPLOAD_THREADS", "8"))
+MAX_QUEUE_DEPTH = int(os.environ.get("MAX_QUEUE_DEPTH", "32"))
+DEFAULT_TOOL_CONCURRENCY = int(os.environ.get("DEFAULT_TOOL_CONCURRENCY", str(BUILD_WORKERS)))
+WORKER_START_METHOD = os.environ.get("WORKER_START_METHOD", "spawn")
+
+# Checks value of env. variable
+if EXECUTOR_MODE not in ("process", "thread"):
+    logger.error("Invalid executor mode, set either to process or thread. Falling back to process.")
+    EXECUTOR_MODE = "process"
+
+
+def parse_tool_concurrency(value):
+    """Parse per-tool concurrency limits in the form 'pptx=2,docx=4'.
+
+    :return: Dictionary mapping tool name to its concurrency limit
+    """
+
+    limits = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        try:
+            tool, limit = item.split("=")
+            limits[tool.strip()] = max(1, int(limit))
+        except ValueError:
+            logger.error(f"Invalid TOOL_CONCURRENCY entry '{item}', expected tool=limit")
+    return limits
+
+
+TOOL_CONCURRENCY = parse_tool_concurrency(os.environ.get("TOOL_CONCURRENCY", ""))
+
+
+def call(func, *args, **kwargs):
+    """Calls func, given either as a function or as a 'module:function' string.
+
+    The module of a string is imported where the call runs, so the server process does not
+    need to import the builders (and python-pptx, python-docx, openpyxl) to dispatch them.
+    """
+    if isinstance(func, str):
+        module, _, name = func.partition(":")
+        func = getattr(importlib.import_module(module), name)
+    return func(*args, **kwargs)
+
+
+def warm_up_worker(modules, documents):
+    """Imports modules and builds each document once, returns time of each step in seconds.
+
+    :param modules: Modules imported in the given order
+    :param documents: (label, builder, keyword arguments) of documents built and discarded,
+        which fills the template cache and the library caches of the worker
+    """
+    timings = {f"import {module}": seconds for module, seconds in import_modules(modules).items()}
+    for label, func, kwargs in documents:
+        start = time.perf_counter()
+        try:
+            # Metrics of the warm-up builds are dropped, they are not requests
+            result, _ = run_captured(call, func, **kwargs)
+            result.close()
+        except Exception as e:
+            logger.error(f"Warm-up build of {label} failed: {e}")
+            continue
+        timings[f"build {label}"] = time.perf_counter() - start
+    return timings
+
+
+# Result of the warm-up of this build worker process
+_worker_warm_up = None
+
+
+def run_worker_warm_up(func, *args):
+    """Build pool initializer, warms up a new worker before it takes any build"""
+    global _worker_warm_up
+    try:
+        _worker_warm_up = func(*args)
+    except Exception as e:
+        # A failing initializer would break the whole pool
+        logger.error(f"Worker warm-up failed: {e}")
+        _worker_warm_up = {}
+
+
+def get_worker_warm_up():
+    """Returns result of the warm-up of this build worker"""
+    return _worker_warm_up
+
+
+class QueueFullError(Exception):
+    """Raised when a tool already has the maximum number of requests waiting."""
+
+
+class BuildExecutor:
+    """Runs document builders and uploads off the event loop.
+
+    Builders (python-pptx, python-docx, openpyxl) are CPU-bound and run on a process
+    pool, uploads are I/O-bound and run on a thread pool. Each tool gets its own
+    concurrency limit and a bounded queue, requests beyond the queue are rejected.
+    """
+
+    def __init__(self, mode=EXECUTOR_MODE, build_workers=BUILD_WORKERS, upload_threads=UPLOAD_THREADS,
+                 max_queue_depth=MAX_QUEUE_DEPTH, tool_concurrency=None):
+        self.mode = mode
+        self.build_workers = build_workers
+        self.upload_threads = upload_threads
+        self.max_queue_depth = max_queue_depth
+        self.tool_concurrency = TOOL_CONCURRENCY if tool_concurrency is None else tool_concurrency
+
+        self._build_pool = None
+        self._upload_pool = None
+        self._warm_up = None
+        self.pool_restarts = 0
+        self._pool_lock = threading.Lock()
+        self._semaphores = {}
+        self._stats = {}
+
+    def _get_build_pool(self):
+        """Create the build pool lazily on first use"""
+        with self._pool_lock:
+            if self._build_pool is None:
+                if self.mode == "process":
+                    context = multiprocessing.get_context(WORKER_START_METHOD)
+                    # Every worker runs the warm-up first, also workers started later
+                    initializer, initargs = (run_worker_warm_up, self._warm_up) if self._warm_up else (None, ())
+                    self._build_pool = ProcessPoolExecutor(max_workers=self.build_workers, mp_context=context,
+                                                           initializer=initializer, initargs=initargs)
+                else:
+                    self._build_pool = ThreadPoolExecutor(max_workers=self.build_workers,
+                                                          thread_name_prefix="build")
+                logger.info(f"Started {self.mode} build pool with {self.build_workers} workers")
+            return self._build_pool
+
+    def _get_upload_pool(self):
+        """Create the upload pool lazily on first use"""
+        with self._pool_lock:
+            if self._upload_pool is None:
+                self._upload_pool = ThreadPoolExecutor(max_workers=self.upload_threads,
+                                                       thread_name_prefix="upload")
+            return self._upload_pool
+
+    def _get_tool_state(self, tool):
+        """Returns semaphore and stats for the tool, creating them on first use"""
+        if tool not in self._semaphores:
+            limit = self.tool_concurrency.get(tool, DEFAULT_TOOL_CONCURRENCY)
+            self._semaphores[tool] = asyncio.Semaphore(limit)
+            self._stats[tool] = {
+                "limit": limit,
+                "queued": 0,
+                "running": 0,
+                "completed": 0,
+                "failed": 0,
+                "rejected": 0,
+            }
+        return self._semaphores[tool], self._stats[tool]
+
+    async def run_build(self, tool, func, *args, **kwargs):
+        """Run a document builder on the build pool.
+
+        :param tool: Name of the tool, used for concurrency limits and metrics
+        :param func: Picklable top-level function building the document or its 'module:function' name
+        :return: Result of the builder
+        :raises QueueFullError: If the tool queue is already full
+        """
+
+        semaphore, stats = self._get_tool_state(tool)
+
+        # Reject instead of queueing without bound
+        if stats["queued"] >= self.max_queue_depth:
+            stats["rejected"] += 1
+            raise QueueFullError(
+                f"Server is busy: {stats['queued']} {tool} requests are already waiting, please retry later."
+            )
+
+        stats["queued"] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            # Leaves the queue both when acquired and when cancelled while waiting
+            stats["queued"] -= 1
+
+        stats["running"] += 1
+        pool = None
+        try:
+            loop = asyncio.get_running_loop()
+            # Metrics recorded by the builder in the worker are replayed here
+            task = partial(run_captured, profiled, tool, call, func, *args, **kwargs)
+            pool = self._get_build_pool()
+            try:
+                future = loop.run_in_executor(pool, task)
+            except BrokenProcessPool:
+                # The pool broke while idle, this build has not run yet, so run it on a new pool
+                self._reset_build_pool(pool)
+                pool = self._get_build_pool()
+                future = loop.run_in_executor(pool, task)
+            result, events = await future
+            replay(events)
+            stats["completed"] += 1
+            return result
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for running out of memory), the pool stays unusable.
+            # Builds running on it fail, later builds start a new pool.
+            stats["failed"] += 1
+            self._reset_build_pool(pool)
+            raise
+        except Exception:
+            stats["failed"] += 1
+            raise
+        finally:
+            stats["running"] -= 1
+            semaphore.release()
+
+    def _reset_build_pool(self, pool):
+        """Drops a broken build pool, unless it was already replaced by another failed build"""
+        with self._pool_lock:
+            if pool is None or self._build_pool is not pool:
+                return
+            self._build_pool = None
+        logger.error("A build worker terminated abruptly, starting a new build pool")
+        self.pool_restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run_upload(self, func, *args, **kwargs):
+        """Run a blocking upload on the upload thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_upload_pool(), partial(func, *args, **kwargs))
+
+    def warm_up(self, func, *args):
+        """Runs func(*args) in every build worker before it takes any build, starting the workers now.
+
+        In thread mode, func runs once in this process.
+
+        :return: Results of func, one per worker
+        """
+        if self.mode != "process":
+            return [func(*args)]
+
+        with self._pool_lock:
+            pool_started = self._build_pool is not None
+            self._warm_up = (func, *args)
+        pool = self._get_build_pool()
+
+        # Each task submitted while no worker is idle starts a new worker, which runs the
+        # warm-up as its initializer. A pool started before has no initializer.
+        task = partial(func, *args) if pool_started else get_worker_warm_up
+        futures = [pool.submit(task) for _ in range(self.build_workers)]
+        return [future.result() for future in futures]
+
+    def queue_stats(self):
+        """Returns a snapshot of queue depth and counters per tool"""
+        return {tool: dict(stats) for tool, stats in self._stats.items()}
+
+    def shutdown(self, wait=True):
+        """Stops the worker pools"""
+        with self._pool_lock:
+            if self._build_pool is not None:
+                self._build_pool.shutdown(wait=wait)
+                self._build_pool = None
+            if self._upload_pool is not None:
+                self._upload_pool.shutdown(wait=wait)
+                self._upload_pool = None
+
+
+executor = BuildExecutor()
+
+
+def collect_queue_metrics():
+    """Returns queue depth and counters of the executor for the metrics endpoint"""
+    stats = executor.queue_stats()
+    return [
+        ("executor_queued_requests", "Requests waiting for a build worker", "gauge",
+         [({"tool": tool}, tool_stats["queued"]) for tool, tool_stats in stats.items()]),
+        ("executor_running_builds", "Documents being built", "gauge",
+         [({"tool": tool}, tool_stats["running"]) for tool, tool_stats in stats.items()]),
+        ("executor_rejected_requests_total", "Requests rejected because the queue was full", "counter",
+         [({"tool": tool}, tool_stats["rejected"]) for tool, tool_stats in stats.items()]),
+        ("executor_build_pool_restarts_total", "Build pools replaced after a build worker terminated abruptly",
+         "counter", [({}, executor.pool_restarts)]),
+    ]
+
+
+registry.add_collector(collect_queue_metrics)
@@ -1,14 +1,320 @@
+# Imported first, the startup is measured from here
+from startup import startup, import_modules, STARTUP_WARMUP
+from contextlib import asynccontextmanager
 from fastmcp import FastMCP
 from pydantic import Field
 from typing import Annotated, List, Dict, Any, Optional
 import io
-from create_xlsx import markdown_to_excel
-from create_docx import markdown_to_word
-from create_pptx import create_presentation
-from create_msg import create_eml
-from upload_file import upload_file
+import os
+import asyncio
+import signal
+import time
+from upload_file import upload_file_async, get_upload_backend, generate_unique_object_name, s3_ready, UPLOAD_STRATEGY
+from executor import executor, warm_up_worker
+from supervisor import Supervisor, WorkerRecycler, exit_on_signal, all_workers_ready, WEB_WORKERS, \
+    WEB_WORKER_MAX_REQUESTS, WEB_GRACEFUL_TIMEOUT
+from result_cache import result_cache, make_cache_key
+from template_cache import template_cache
+from bundle import ZipBundle
+import metrics
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
 
-mcp = FastMCP("MCP Office Documents")
+# Builders run on the worker pool. They are passed by name and imported by the worker, so
+# the server process starts without importing python-pptx, python-docx and openpyxl.
+BUILD_PRESENTATION = "create_pptx:build_presentation"
+BUILD_SLIDE_PARTS = "create_pptx:build_slide_parts"
+ASSEMBLE_PRESENTATION = "create_pptx:assemble_presentation"
+BUILD_WORD = "create_docx:build_word"
+BUILD_EXCEL = "create_xlsx:build_excel"
+BUILD_EML = "create_msg:build_eml"
+BUILD_EML_DRAFTS = "create_msg:build_eml_drafts"
+BUILD_MBOX = "create_msg:build_mbox"
+WRITE_EML_FILE = "create_msg:write_eml_file"
+
+# Imported in the background once the server has started, heavy dependencies first so the
+# startup report shows the import time of each of them
+BUILDER_MODULES = ["lxml.etree", "pptx", "docx", "openpyxl", "create_pptx", "create_docx", "create_xlsx", "create_msg"]
+# Large presentations are split and S3 uploads run in the server process
+SERVER_MODULES = ["lxml.etree", "pptx", "create_pptx"] + (["boto3", "boto3.s3.transfer"] if UPLOAD_STRATEGY == "S3" else [])
+
+# Tiny documents built and discarded by each build worker at startup, together they use
+# every template and every kind of slide, block and formula
+WARM_UP_SLIDES = [
+    {"slide_type": "title", "slide_title": "Warm-up", "author": "Server"},
+    {"slide_type": "section", "slide_title": "Warm-up"},
+    {"slide_type": "content", "slide_title": "Warm-up", "slide_text": [
+        {"text": "Item", "indentation_level": 1},
+        {"text": "Sub-item", "indentation_level": 2},
+    ]},
+]
+WARM_UP_MARKDOWN = """# Warm-up
+
+Text with **bold**, *italic* and `code`.
+
+- Item
+  - Sub-item
+
+| Item | Amount | Total |
+|------|--------|-------|
+| A | 1 | =B[0]*2 |
+| B | 2 | =SUM(B[0]:B[1]) |
+"""
+WARM_UP_DOCUMENTS = [
+    ("pptx 4:3", BUILD_PRESENTATION, {"slides": WARM_UP_SLIDES, "format": "4:3"}),
+    ("pptx 16:9", BUILD_PRESENTATION, {"slides": WARM_UP_SLIDES, "format": "16:9"}),
+    ("docx", BUILD_WORD, {"markdown_content": WARM_UP_MARKDOWN}),
+    ("xlsx", BUILD_EXCEL, {"markdown_content": WARM_UP_MARKDOWN}),
+    ("eml", BUILD_EML, {"re": "Warm-up", "content": "<p>Warm-up</p>", "to": ["warm-up@example.com"]}),
+]
+
+# Documents built in the warm-up, only set when running as the server (see __main__)
+warm_up_documents = []
+
+def warm_up():
+    """Warms up all build workers and imports the modules used by the server process"""
+    timings = {}
+    for worker_timings in executor.warm_up(warm_up_worker, BUILDER_MODULES, warm_up_documents):
+        for step, seconds in worker_timings.items():
+            timings[step] = max(seconds, timings.get(step, 0))
+    for module, seconds in import_modules(SERVER_MODULES).items():
+        step = f"import {module}"
+        timings[step] = max(seconds, timings.get(step, 0))
+    return timings
+
+@asynccontextmanager
+async def lifespan(server):
+    """Starts the warm-up in the background when the server starts, stops the build pool when it stops"""
+    startup.mark("serving")
+    startup.start_warm_up(warm_up)
+    try:
+        yield {}
+    finally:
+        executor.shutdown()
+
+mcp = FastMCP("MCP Office Documents", lifespan=lifespan)
+
+async def run_document_build(suffix, build_func, arguments):
+    """Builds document on the worker pool, large presentations in chunks on several workers"""
+    if build_func == BUILD_PRESENTATION and executor.mode == "process":
+        from create_pptx import split_slides
+
+        chunks = split_slides(arguments["slides"], executor.build_workers)
+        if len(chunks) > 1:
+            format = arguments.get("format", "4:3")
+            chunk_parts = await asyncio.gather(*(
+                executor.run_build(suffix, BUILD_SLIDE_PARTS, chunk, format, first_index)
+                for first_index, chunk in chunks
+            ))
+            slide_parts = [slide_part for parts in chunk_parts for slide_part in parts]
+            return await executor.run_build(suffix, ASSEMBLE_PRESENTATION, slide_parts, format)
+
+    return await executor.run_build(suffix, build_func, **arguments)
+
+async def generate_document(tool, suffix, build_func, arguments, template_kind=None):
+    """Builds document on the worker pool and uploads it, reusing identical earlier results.
+
+    :param tool: Name of the MCP tool, part of the cache key
+    :param suffix: File extension of the document
+    :param build_func: 'module:function' name of the builder returning the document as BytesIO object
+    :param arguments: Keyword arguments of the builder
+    :param template_kind: Template used by the builder, its version is part of the cache key
+    :return: Message with link to the document
+    """
+
+    backend = get_upload_backend()
+    if backend is None:
+        return "No upload strategy set, presentation cannot be created."
+
+    with metrics.track_request(suffix) as request:
+        # Reuse already uploaded document for identical request
+        template_fingerprint = template_cache.fingerprint(template_kind) if template_kind else ""
+        cache_key = make_cache_key(tool, arguments, template_fingerprint)
+        object_name = result_cache.get(cache_key)
+        if object_name:
+            result = await backend.link_async(object_name)
+            if result:
+                print(f"Reusing cached document {object_name} for {tool}")
+                request["status"] = "cached"
+                return result
+            result_cache.invalidate(cache_key)
+
+        # Build on the worker pool, then upload without blocking the event loop
+        file_object = await run_document_build(suffix, build_func, arguments)
+        size = file_object.getbuffer().nbytes
+        metrics.observe("documents_output_bytes", size, tool=suffix)
+
+        object_name = generate_unique_object_name(suffix)
+        result = await backend.upload_async(file_object, object_name)
+        file_object.close()
+
+        if result:
+            result_cache.put(cache_key, object_name, size)
+        else:
+            mark_upload_failed(suffix, request)
+        return result
+
+def mark_upload_failed(suffix, request):
+    """Counts upload that returned no link as failed request"""
+    request["status"] = "error"
+    metrics.inc("documents_errors_total", tool=suffix, type="UploadFailed")
+
+async def generate_email(arguments):
+    """Builds email draft on the worker pool and uploads it.
+
+    Email drafts carry the current date, so they are never reused from the cache.
+    """
+    with metrics.track_request("eml") as request:
+        # Written by the worker chunk by chunk to a temporary file, only its path is sent back
+        path = await executor.run_build("eml", WRITE_EML_FILE, **arguments)
+        try:
+            with open(path, "rb") as file_object:
+                metrics.observe("documents_output_bytes", os.fstat(file_object.fileno()).st_size, tool="eml")
+                result = await upload_file_async(file_object, "eml")
+        finally:
+            os.remove(path)
+
+        if not result:
+            mark_upload_failed("eml", request)
+        return result
+
+def bundle_drafts(drafts):
+    """Packs (name, BytesIO) email drafts into a ZIP archive, returns its file object"""
+    zip_bundle = ZipBundle()
+    for name, file_object in drafts:
+        zip_bundle.add(f"{name}.eml", file_object)
+    return zip_bundle.close()
+
+async def upload_draft(file_object):
+    """Uploads one email draft of a bulk request and closes it"""
+    try:
+        metrics.observe("documents_output_bytes", file_object.getbuffer().nbytes, tool="eml")
+        return await upload_file_async(file_object, "eml")
+    finally:
+        file_object.close()
+
+async def generate_email_bulk(arguments, delivery):
+    """Builds personalised email drafts on the worker pool and uploads them.
+
+    :param arguments: Keyword arguments of build_eml_drafts
+    :param delivery: 'separate' uploads each draft concurrently, 'zip' and 'mbox' upload one file with all drafts
+    :return: List of (name, link) of the uploaded files, link is None if the upload failed
+    """
+    with metrics.track_request("eml") as request:
+        if delivery == "mbox":
+            file_object = await executor.run_build("eml", BUILD_MBOX, **arguments)
+            name = "drafts.mbox"
+        else:
+            drafts = await executor.run_build("eml", BUILD_EML_DRAFTS, **arguments)
+            if delivery == "separate":
+                results = await asyncio.gather(*(upload_draft(file_object) for _, file_object in drafts))
+                if not all(results):
+                    mark_upload_failed("eml", request)
+                return [(f"{name}.eml", result) for (name, _), result in zip(drafts, results)]
+
+            file_object = await executor.run_upload(bundle_drafts, drafts)
+            name = "drafts.zip"
+
+        try:
+            file_object.seek(0, os.SEEK_END)
+            metrics.observe("documents_output_bytes", file_object.tell(), tool="eml")
+            file_object.seek(0)
+            result = await upload_file_async(file_object, name.rpartition(".")[2])
+        finally:
+            file_object.close()
+
+        if not result:
+            mark_upload_failed("eml", request)
+        return [(name, result)]
+
+def get_batch_job(job):
+    """Returns (tool, suffix, build_func, arguments, template_kind) of a batch job
+
+    :param job: Job dictionary with 'type' and arguments of the matching single document tool
+    :raises ValueError: If the job type is unknown or required argument is missing
+    """
+
+    def required(key):
+        if key not in job:
+            raise ValueError(f"Missing '{key}' for {job_type} job")
+        return job[key]
+
+    job_type = job.get("type")
+
+    if job_type == "pptx":
+        format = job.get("format", "16:9")
+        template_kind = "pptx_16_9" if format == "16:9" else "pptx_4_3"
+        return ("create_powerpoint_presentation", "pptx", BUILD_PRESENTATION,
+                {"slides": required("slides"), "format": format}, template_kind)
+    if job_type == "docx":
+        return ("create_word_from_markdown", "docx", BUILD_WORD,
+                {"markdown_content": required("markdown_content")}, "docx")
+    if job_type == "xlsx":
+        return ("create_excel_from_markdown", "xlsx", BUILD_EXCEL,
+                {"markdown_content": required("markdown_content")}, None)
+    if job_type == "eml":
+        return ("create_email_draft", "eml", BUILD_EML, {
+            "to": job.get("to"),
+            "cc": job.get("cc"),
+            "bcc": job.get("bcc"),
+            "re": required("subject"),
+            "content": required("content"),
+            "priority": job.get("priority", "normal"),
+            "language": job.get("language", "cs-CZ"),
+        }, None)
+
+    raise ValueError(f"Unknown job type '{job_type}', use pptx, docx, xlsx or eml")
+
+async def run_batch_job(job):
+    """Builds and uploads document of one batch job, returns (result, error, seconds)"""
+    start = time.perf_counter()
+    try:
+        tool, suffix, build_func, arguments, template_kind = get_batch_job(job)
+        if suffix == "eml":
+            result = await generate_email(arguments)
+        else:
+            result = await generate_document(tool, suffix, build_func, arguments, template_kind)
+        return result, None, time.perf_counter() - start
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+
+async def run_bundle_job(index, job, bundle, bundle_lock):
+    """Builds document of one batch job and adds it to the ZIP bundle, returns (file name, error, seconds)"""
+    start = time.perf_counter()
+    try:
+        tool, suffix, build_func, arguments, template_kind = get_batch_job(job)
+        with metrics.track_request(suffix):
+            file_object = await run_document_build(suffix, build_func, arguments)
+            metrics.observe("documents_output_bytes", file_object.getbuffer().nbytes, tool=suffix)
+
+            name = os.path.basename(str(job.get("name") or f"document_{index}"))
+            # Archive is written by one job at a time, off the event loop
+            async with bundle_lock:
+                name = await executor.run_upload(bundle.add, f"{name}.{suffix}", file_object)
+        return name, None, time.perf_counter() - start
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+
+@mcp.custom_route("/health", methods=["GET"])
+async def health_endpoint(request: Request) -> PlainTextResponse:
+    """Liveness check, the server is running"""
+    return PlainTextResponse("ok")
+
+@mcp.custom_route("/ready", methods=["GET"])
+async def ready_endpoint(request: Request) -> PlainTextResponse:
+    """Readiness check, 503 until the warm-up has finished (of all workers in multi-worker mode)
+    and while the S3 bucket is unreachable"""
+    if not startup.ready or not all_workers_ready():
+        return PlainTextResponse("warming up", status_code=503)
+    if UPLOAD_STRATEGY == "S3" and not await s3_ready():
+        return PlainTextResponse("S3 bucket unreachable", status_code=503)
+    return PlainTextResponse("ready")
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @mcp.tool(
     name="create_excel_from_markdown",
@@ -54,8 +360,10 @@ async def create_excel_document(
     print(f"Converting markdown to Excel document")
 
     try:
-        # markdown_to_excel now handles upload internally and returns URL
-        result = markdown_to_excel(markdown_content)
+        result = await generate_document(
+            "create_excel_from_markdown", "xlsx", BUILD_EXCEL,
+            {"markdown_content": markdown_content}
+        )
         print(f"Excel document uploaded successfully")
         return result
     except Exception as e:
@@ -111,8 +419,10 @@ async def create_word_document(
     print(f"Converting markdown to Word document")
 
     try:
-        # markdown_to_word now handles upload internally and returns URL
-        result = markdown_to_word(markdown_content)
+        result = await generate_document(
+            "create_word_from_markdown", "docx", BUILD_WORD,
+            {"markdown_content": markdown_content}, template_kind="docx"
+        )
         print(f"Word document uploaded successfully")
         return result
     except Exception as e:
@@ -147,8 +457,11 @@ async def create_powerpoint_presentation(
     print(f"Creating PowerPoint presentation with {len(slides)} slides in {format} format")
 
     try:
-        # create_presentation already handles upload internally and returns URL
-        result = create_presentation(slides, format)
+        template_kind = "pptx_16_9" if format == "16:9" else "pptx_4_3"
+        result = await generate_document(
+            "create_powerpoint_presentation", "pptx", BUILD_PRESENTATION,
+            {"slides": slides, "format": format}, template_kind=template_kind
+        )
         print(f"PowerPoint presentation created: {result}")
         return result
     except Exception as e:
@@ -206,27 +519,176 @@ async def create_email_draft(
     print(f"Creating email draft with subject: {subject}")
 
     try:
-        # create_eml already handles upload internally and returns URL
-        result = create_eml(
-            to=to,
-            cc=cc,
-            bcc=bcc,
-            re=subject,
-            content=content,
-            priority=priority,
-            language=language
-        )
+        result = await generate_email({
+            "to": to,
+            "cc": cc,
+            "bcc": bcc,
+            "re": subject,
+            "content": content,
+            "priority": priority,
+            "language": language
+        })
         print(f"Email draft created: {result}")
         return result
     except Exception as e:
         print(f"Error creating email draft: {e}")
         return f"Error creating email draft: {str(e)}"
 
-if __name__ == "__main__":
+@mcp.tool(
+    name="create_email_drafts_bulk",
+    description="Creates personalised email drafts (mail merge) from one template, one draft per recipient.",
+    tags={"email", "eml", "communication", "batch"},
+    annotations={"title": "Bulk Email Draft Creator"}
+)
+async def create_email_drafts_bulk(
+    content: Annotated[str, Field(description="BODY CONTENT ONLY, same rules as for create_email_draft. May contain {{field}} placeholders filled from the fields of each recipient.")],
+    subject: Annotated[str, Field(description="Email subject line, may contain {{field}} placeholders")],
+    recipients: Annotated[List[Dict[str, Any]], Field(description="List of recipient dictionaries with 'to', 'cc', 'bcc' address lists, 'fields' with the placeholder values and optional 'name' of the draft file (without extension).")],
+    delivery: Annotated[str, Field(description="'separate' for one link per draft, 'zip' for one ZIP archive of .eml files, 'mbox' for one mbox file", default="separate")] = "separate",
+    priority: Annotated[str, Field(description="Email priority: 'low', 'normal', or 'high'", default="normal")] = "normal",
+    language: Annotated[str, Field(description="Language code for proofreading in Outlook (e.g., 'cs-CZ', 'en-US', 'de-DE')", default="cs-CZ")] = "cs-CZ"
+) -> str:
+    """
+    Creates one email draft per recipient from the same content and subject (mail merge).
+
+    Placeholders like {{name}} in content and subject are replaced with the value from the
+    recipient's 'fields', e.g. {"to": ["jan@example.com"], "fields": {"name": "Jan Novák"}}.
+    Values are HTML-escaped in the content. A placeholder without value is an error.
+
+    Delivery:
+    - separate: each draft is uploaded on its own, one link per recipient
+    - zip: all drafts in one ZIP archive of .eml files
+    - mbox: all drafts in one mbox file
+    """
+
+    print(f"Creating {len(recipients)} email drafts with subject: {subject}")
+
+    if delivery not in ("separate", "zip", "mbox"):
+        return "Error creating email drafts: delivery must be 'separate', 'zip' or 'mbox'"
+
+    try:
+        start = time.perf_counter()
+        files = await generate_email_bulk({
+            "content": content,
+            "subject": subject,
+            "recipients": recipients,
+            "priority": priority,
+            "language": language,
+        }, delivery)
+
+        failed = sum(1 for _, result in files if not result)
+        summary = f"Created {len(recipients)} email drafts in {time.perf_counter() - start:.2f} s"
+        summary += f", {failed} uploads failed." if failed else "."
+        lines = [summary]
+        for index, (name, result) in enumerate(files, start=1):
+            lines.append(f"{index}. {name}: {result or 'Error: upload failed'}")
+        print(summary)
+        return "\n".join(lines)
+    except Exception as e:
+        print(f"Error creating email drafts: {e}")
+        return f"Error creating email drafts: {str(e)}"
+
+@mcp.tool(
+    name="create_documents_batch",
+    description="Creates several documents (PowerPoint, Word, Excel, email drafts) in one call, built in parallel.",
+    tags={"batch", "powerpoint", "word", "excel", "email"},
+    annotations={"title": "Batch Document Creator"}
+)
+async def create_documents_batch(
+    jobs: Annotated[List[Dict[str, Any]], Field(description="List of job dictionaries. Each job must have 'type' (pptx/docx/xlsx/eml) and the arguments of the matching single document tool. Optional 'name' sets the file name inside a bundle.")],
+    bundle: Annotated[bool, Field(description="Deliver all documents as one ZIP archive instead of separate files", default=False)] = False
+) -> str:
+    """
+    Creates multiple documents at once, e.g. a presentation, a memo and a spreadsheet for the same request.
+
+    Job Types:
+    - pptx: {"type": "pptx", "slides": [...], "format": "16:9"} (same slides as create_powerpoint_presentation)
+    - docx: {"type": "docx", "markdown_content": "..."} (same markdown as create_word_from_markdown)
+    - xlsx: {"type": "xlsx", "markdown_content": "..."} (same markdown as create_excel_from_markdown)
+    - eml: {"type": "eml", "subject": "...", "content": "...", "to": [...], "cc": [...], "bcc": [...], "priority": "normal", "language": "cs-CZ"}
+
+    Returns one line per job in the order of the jobs with the link or error and the time it took.
+    With bundle=true all documents are packed into a single ZIP archive with one link, jobs may set
+    'name' (without extension) for their file name in the archive.
+    A failing job does not stop the other jobs.
+    """
+
+    print(f"Creating batch of {len(jobs)} documents{' as ZIP bundle' if bundle else ''}")
+
+    start = time.perf_counter()
+    if bundle:
+        zip_bundle = ZipBundle()
+        bundle_lock = asyncio.Lock()
+        outcomes = await asyncio.gather(*(
+            run_bundle_job(index, job, zip_bundle, bundle_lock) for index, job in enumerate(jobs, start=1)
+        ))
+    else:
+        outcomes = await asyncio.gather(*(run_batch_job(job) for job in jobs))
+
+    lines = []
+    failed = 0
+    for index, (job, (result, error, seconds)) in enumerate(zip(jobs, outcomes), start=1):
+        job_type = job.get("type", "unknown")
+        if error is None:
+            result = f"added to bundle as {result}" if bundle else result
+            lines.append(f"{index}. {job_type}: {result} ({seconds:.2f} s)")
+        else:
+            failed += 1
+            lines.append(f"{index}. {job_type}: Error: {error} ({seconds:.2f} s)")
+
+    # Upload the bundle once all documents are in it
+    if bundle:
+        bundle_file = await executor.run_upload(zip_bundle.close)
+        try:
+            if failed < len(jobs):
+                with metrics.track_request("zip") as request:
+                    result = await upload_file_async(bundle_file, 'zip')
+                    if not result:
+                        mark_upload_failed("zip", request)
+                # Without the bundle none of the documents in it is delivered
+                if not result:
+                    failed = len(jobs)
+                lines.insert(0, f"Bundle: {result or 'Error: upload failed'}")
+        finally:
+            bundle_file.close()
+
+    total = time.perf_counter() - start
+    summary = f"Batch finished in {total:.2f} s: {len(jobs) - failed} succeeded, {failed} failed."
+    print(summary)
+    return "\n".join([summary] + lines)
+
+def run_server(sock=None):
+    """Runs the MCP server, on the socket shared by all workers in multi-worker mode"""
+    # Lets the lifespan stop the build pool after the graceful shutdown
+    signal.signal(signal.SIGTERM, exit_on_signal)
+
+    uvicorn_config = {"timeout_graceful_shutdown": WEB_GRACEFUL_TIMEOUT}
+    options = {}
+    if sock is not None:
+        # Requests of one client may reach different workers, so no session state is kept
+        options = {"sockets": [sock], "stateless_http": True, "show_banner": False}
+        if WEB_WORKER_MAX_REQUESTS:
+            # The worker stops after serving this many requests and the master starts a new one
+            options["middleware"] = [Middleware(WorkerRecycler)]
+
     mcp.run(
         transport="streamable-http",
         host="0.0.0.0",
         port=8958,
         log_level="info",
-        path="/mcp"
+        path="/mcp",
+        uvicorn_config=uvicorn_config,
+        **options
     )
+
+startup.mark("imports")
+
+if __name__ == "__main__":
+    # Only the server builds documents in the warm-up, not e.g. tests importing this module
+    if STARTUP_WARMUP:
+        warm_up_documents = WARM_UP_DOCUMENTS
+
+    if WEB_WORKERS > 1:
+        Supervisor(run_server, "0.0.0.0", 8958).run()
+    else:
+        run_server()
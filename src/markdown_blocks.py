@@ -0,0 +1,175 @@
+import re
+from typing import Iterator, List, NamedTuple
+
+# Block kinds
+BLANK = "blank"
+HEADING = "heading"
+TABLE = "table"
+LIST_ITEM = "list_item"
+QUOTE = "quote"
+RULE = "rule"
+PARAGRAPH = "paragraph"
+
+ORDERED_ITEM_PATTERN = re.compile(r'^\d+\.\s+(.+)')
+UNORDERED_ITEM_PATTERN = re.compile(r'^[-*+]\s+(.+)')
+
+# Spaces per list nesting level, matches typical markdown indentation
+LIST_INDENT = 3
+
+
+class Block(NamedTuple):
+    """Markdown block produced by iter_blocks.
+
+    kind: one of BLANK, HEADING, TABLE, LIST_ITEM, QUOTE, RULE, PARAGRAPH
+    text: text of heading, list item, quote or paragraph, hard line breaks are kept as '  \\n'
+    level: heading level or list item nesting level (0 for top level)
+    ordered: True for numbered list items
+    start, end: range of lines of the block (for tables, rows are read with iter_table_rows)
+    count: number of consecutive empty lines of BLANK block
+    """
+    kind: str
+    text: str = ""
+    level: int = 0
+    ordered: bool = False
+    start: int = 0
+    end: int = 0
+    count: int = 0
+
+
+def find_table_end(lines, start_idx):
+    """Returns index of the first line after the markdown table starting at start_idx"""
+    i = start_idx
+
+    # Find all table lines
+    while i < len(lines):
+        line = lines[i].strip()
+        if line.startswith('|') and line.endswith('|'):
+            i += 1
+        else:
+            break
+
+    return i
+
+
+def iter_table_rows(lines, start_idx, end_idx):
+    """Yields cells of each markdown table row between start_idx and end_idx"""
+    for i in range(start_idx, end_idx):
+        line = lines[i].strip()
+
+        # Skip separator line (contains dashes)
+        if '---' in line or ':-:' in line or ':--' in line or '--:' in line:
+            continue
+
+        # Split by | and clean up
+        yield [cell.strip() for cell in line.split('|')[1:-1]]  # Remove empty first/last
+
+
+def parse_table(lines, start_idx):
+    """Parse markdown table and return the table data and next line index"""
+    i = find_table_end(lines, start_idx)
+
+    if i - start_idx < 2:  # Need at least header and separator
+        return None, start_idx + 1
+
+    # Parse table data
+    table_data = list(iter_table_rows(lines, start_idx, i))
+
+    return table_data, i
+
+
+def heading_block(line, start, end):
+    """Returns heading block for a stripped line starting with #"""
+    header_text = line.lstrip('#')
+    return Block(HEADING, header_text.strip(), level=len(line) - len(header_text), start=start, end=end)
+
+
+def iter_blocks(lines: List[str]) -> Iterator[Block]:
+    """Splits markdown lines into typed blocks in a single pass.
+
+    Lines ending with two spaces join the following lines into one block with hard line
+    breaks, except for tables and items of a list. Tables need at least two lines (header and
+    separator), shorter ones are dropped.
+    """
+    i = 0
+    line_count = len(lines)
+    in_list = False
+
+    while i < line_count:
+        line = lines[i]
+        stripped = line.strip()
+
+        # Consecutive empty lines
+        if not stripped:
+            start = i
+            while i < line_count and not lines[i].strip():
+                i += 1
+            yield Block(BLANK, start=start, end=i, count=i - start)
+            continue
+
+        # Table, checked first as its rows may end with two spaces too
+        if stripped.startswith('|'):
+            end = find_table_end(lines, i)
+            if end - i >= 2:  # Need at least header and separator
+                yield Block(TABLE, start=i, end=end)
+                in_list = False
+                i = end
+                continue
+
+        ordered_match = ORDERED_ITEM_PATTERN.match(stripped)
+        item_match = ordered_match or UNORDERED_ITEM_PATTERN.match(stripped)
+
+        # Line ends with two spaces (line break), collect lines of the same paragraph
+        if line.endswith('  ') and not (in_list and item_match):
+            start = i
+            paragraph_lines = []
+            while i < line_count:
+                current_line = lines[i]
+                if not current_line.strip():  # Empty line ends the paragraph
+                    break
+
+                paragraph_lines.append(current_line)
+                i += 1
+
+                # If line doesn't end with two spaces, this paragraph is complete
+                if not current_line.endswith('  '):
+                    break
+
+            # Join lines with line break markers
+            full_text = '  \n'.join(paragraph_lines)
+
+            if stripped.startswith('#'):
+                yield heading_block(stripped, start, i)
+            elif stripped.startswith('>'):
+                yield Block(QUOTE, full_text[1:].strip(), start=start, end=i)  # Remove > from beginning
+            else:
+                yield Block(PARAGRAPH, full_text, start=start, end=i)
+            in_list = False
+            continue
+
+        in_list = item_match is not None
+
+        if stripped.startswith('#'):
+            yield heading_block(stripped, i, i + 1)
+            i += 1
+
+        elif stripped.startswith('|'):
+            # Single table line without separator
+            i += 1
+
+        elif item_match:
+            indent = len(line) - len(line.lstrip())
+            yield Block(LIST_ITEM, item_match.group(1), level=indent // LIST_INDENT,
+                        ordered=ordered_match is not None, start=i, end=i + 1)
+            i += 1
+
+        elif stripped.startswith('---') or stripped.startswith('***'):
+            yield Block(RULE, start=i, end=i + 1)
+            i += 1
+
+        elif stripped.startswith('>'):
+            yield Block(QUOTE, stripped[1:].strip(), start=i, end=i + 1)
+            i += 1
+
+        else:
+            yield Block(PARAGRAPH, stripped, start=i, end=i + 1)
+            i += 1
@@ -0,0 +1,407 @@
+import contextvars
+import copy
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of the metrics of each server worker in multi-worker mode
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1"))
+
+# Histogram buckets for durations in seconds and document sizes in bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(9))  # 1 KB to 64 MB
+
+# Metric events recorded while running a builder on a worker, see run_captured
+_captured_events = contextvars.ContextVar("captured_metric_events", default=None)
+
+
+def escape_label_value(value):
+    """Escapes backslash, quote and newline in label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    """Returns labels in the Prometheus text format, e.g. {tool="pptx"}"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+def format_value(value):
+    """Returns number in the Prometheus text format"""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+
+    def apply(self, labels, value):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    @staticmethod
+    def merge(total, values):
+        """Adds values of the counter (e.g. of another process) to total"""
+        for labels, value in values.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def samples(self, values=None):
+        for labels, value in sorted((self._values if values is None else values).items()):
+            yield self.name, labels, value
+
+
+class Histogram:
+    """Histogram with cumulative buckets, sum and count per label set"""
+
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def apply(self, labels, value):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts = entry[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    @staticmethod
+    def merge(total, values):
+        """Adds values of the histogram (e.g. of another process) to total"""
+        for labels, (counts, value_sum, count) in values.items():
+            entry = total.get(labels)
+            if entry is None:
+                total[labels] = [list(counts), value_sum, count]
+            else:
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += value_sum
+                entry[2] += count
+
+    def samples(self, values=None):
+        for labels, (counts, total, count) in sorted((self._values if values is None else values).items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", labels + (("le", format_value(bound)),), cumulative
+            yield f"{self.name}_bucket", labels + (("le", "+Inf"),), count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class MetricsRegistry:
+    """Collects metrics of the server and renders them in the Prometheus text format.
+
+    Counters and histograms are updated through inc and observe. Values that already
+    exist elsewhere (e.g. executor queue depth) are read at render time by collectors.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help):
+        """Registers counter, returns the existing one if already registered"""
+        return self._metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        """Registers histogram, returns the existing one if already registered"""
+        return self._metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def add_collector(self, collector):
+        """Registers function returning (name, help, type, [(labels dict, value)]) tuples at render time"""
+        self._collectors.append(collector)
+
+    def apply(self, name, labels, value):
+        """Adds value to counter or histogram of given name"""
+        metric = self._metrics.get(name)
+        if metric is None:
+            logger.warning(f"Unknown metric {name}")
+            return
+        with self._lock:
+            metric.apply(labels, value)
+
+    def values(self):
+        """Returns a copy of the values of all counters and histograms"""
+        with self._lock:
+            return {name: copy.deepcopy(metric._values) for name, metric in self._metrics.items()}
+
+    def merge(self, total, values):
+        """Adds values returned by values() (e.g. of another process) to total"""
+        for name, metric_values in values.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(total.setdefault(name, {}), metric_values)
+
+    def collect(self):
+        """Returns (name, help, type, [(labels dict, value)]) of all collectors"""
+        families = []
+        for collector in self._collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        return families
+
+    def render(self, values=None, collected=None):
+        """Returns all metrics in the Prometheus text exposition format
+
+        :param values: Values of counters and histograms to render instead of those of this process
+        :param collected: Results of the collectors to render instead of running them
+        """
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.type}")
+                metric_values = None if values is None else values.get(metric.name, {})
+                for name, labels, value in metric.samples(metric_values):
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+        for name, help, metric_type, samples in (self.collect() if collected is None else collected):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+class SharedMetrics:
+    """Adds up the metrics of pre-forked server workers, whichever worker serves /metrics.
+
+    Each worker writes its counters, histograms and collector results to a file in a
+    shared directory every METRICS_FLUSH_INTERVAL seconds and when it stops. The master
+    adds the values of exited workers to the retired values, so counters do not go back
+    when a worker is replaced. Collector results (mostly gauges) of the running workers
+    are rendered with a worker label holding the pid.
+    """
+
+    def __init__(self, registry, directory=None):
+        self.registry = registry
+        self.directory = directory or tempfile.mkdtemp(prefix="office-docs-metrics-")
+        self.worker_id = None
+        self._flush_lock = threading.Lock()
+
+    def _path(self, worker_id):
+        return os.path.join(self.directory, f"worker-{worker_id}.pickle")
+
+    def _retired_path(self):
+        return os.path.join(self.directory, "retired.pickle")
+
+    @staticmethod
+    def _write(path, data):
+        # Written to a temporary file and renamed, so readers never see a partial file
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(data, f)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def _read_retired(self):
+        try:
+            return self._read(self._retired_path())
+        except FileNotFoundError:
+            return {"workers": set(), "values": {}}
+
+    def start_worker(self, worker_id):
+        """Starts writing the metrics of this worker, called in the new worker process"""
+        self.worker_id = worker_id
+        threading.Thread(target=self._flush_periodically, name="metrics-flush", daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Writing worker metrics failed: {e}")
+
+    def flush(self):
+        """Writes the metrics of this worker"""
+        if self.worker_id is None:
+            return
+        # Periodic and scrape writes in turn, so a file never goes back to older values
+        with self._flush_lock:
+            self._write(self._path(self.worker_id),
+                        {"pid": os.getpid(), "values": self.registry.values(), "collected": self.registry.collect()})
+
+    def retire(self, worker_id):
+        """Adds the values of an exited worker to the retired values, called by the master"""
+        path = self._path(worker_id)
+        retired = self._read_retired()
+        try:
+            self.registry.merge(retired["values"], self._read(path)["values"])
+        except FileNotFoundError:
+            # Exited before writing any metrics
+            pass
+        retired["workers"].add(worker_id)
+        # The retired values include the worker before its file is removed, readers skip it
+        self._write(self._retired_path(), retired)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _read_workers(self):
+        """Returns retired values and metrics of the running workers by worker id"""
+        for _ in range(3):
+            retired = self._read_retired()
+            workers = {}
+            complete = True
+            for file_name in os.listdir(self.directory):
+                if not (file_name.startswith("worker-") and file_name.endswith(".pickle")):
+                    continue
+                worker_id = int(file_name[len("worker-"):-len(".pickle")])
+                if worker_id in retired["workers"]:
+                    continue
+                try:
+                    workers[worker_id] = self._read(os.path.join(self.directory, file_name))
+                except FileNotFoundError:
+                    # Retired meanwhile, read the retired values again
+                    complete = False
+            if complete:
+                break
+        return retired, workers
+
+    def render(self):
+        """Returns metrics of all workers in the Prometheus text exposition format.
+
+        Metrics of this worker are written first and read back like those of the other
+        workers, so any worker serving the next scrape shows at least the same values.
+        """
+        self.flush()
+        retired, workers = self._read_workers()
+
+        values = retired["values"]
+        for worker in workers.values():
+            self.registry.merge(values, worker["values"])
+
+        # One family per metric name, with samples of all running workers
+        families = {}
+        for worker in workers.values():
+            for name, help, metric_type, samples in worker["collected"]:
+                family = families.setdefault(name, (name, help, metric_type, []))
+                family[3].extend((dict(labels, worker=worker["pid"]), value) for labels, value in samples)
+
+        return self.registry.render(values, list(families.values()))
+
+    def close(self):
+        """Removes the shared directory, called by the master once all workers stopped"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+registry = MetricsRegistry()
+
+# Set by the master in multi-worker mode before the workers are forked
+shared_metrics = None
+
+
+def share_between_workers(directory=None):
+    """Makes /metrics of each server worker forked afterwards show metrics of all workers"""
+    global shared_metrics
+    shared_metrics = SharedMetrics(registry, directory)
+    return shared_metrics
+
+
+def render():
+    """Returns metrics of the server (of all its workers) in the Prometheus text exposition format"""
+    if shared_metrics is not None:
+        return shared_metrics.render()
+    return registry.render()
+
+registry.counter("documents_requests_total", "Document requests by tool and status (ok, cached, error)")
+registry.histogram("documents_request_seconds", "Time to create and upload a document")
+registry.histogram("documents_phase_seconds", "Time spent in template, parse, build, serialize and upload phases")
+registry.histogram("documents_output_bytes", "Size of created documents", SIZE_BUCKETS)
+registry.counter("documents_errors_total", "Failed document requests by tool and error type")
+registry.counter("template_cache_requests_total", "Template cache lookups by template kind and result (hit, miss)")
+registry.counter("result_cache_requests_total", "Result cache lookups by result (hit, miss)")
+registry.counter("slide_cache_requests_total", "Slide cache lookups by slide type and result (hit, miss)")
+
+
+def record(name, labels, value):
+    """Records metric value, kept with the captured events when running on a worker"""
+    labels = tuple(sorted(labels.items()))
+    events = _captured_events.get()
+    if events is not None:
+        events.append((name, labels, value))
+    else:
+        registry.apply(name, labels, value)
+
+
+def inc(name, value=1, **labels):
+    """Increments counter"""
+    record(name, labels, value)
+
+
+def observe(name, value, **labels):
+    """Adds observation to histogram"""
+    record(name, labels, value)
+
+
+@contextmanager
+def track_request(tool):
+    """Counts document request by status and measures its duration.
+
+    Yields dictionary whose 'status' may be changed by the caller, e.g. to 'cached'.
+    Exceptions are counted by their type.
+    """
+    request = {"status": "ok"}
+    start = time.perf_counter()
+    try:
+        yield request
+    except Exception as e:
+        request["status"] = "error"
+        inc("documents_errors_total", tool=tool, type=type(e).__name__)
+        raise
+    finally:
+        inc("documents_requests_total", tool=tool, status=request["status"])
+        observe("documents_request_seconds", time.perf_counter() - start, tool=tool)
+
+
+def run_captured(func, *args, **kwargs):
+    """Runs func and returns (result, metric events recorded meanwhile).
+
+    Builders run in worker processes whose metrics would be lost, so the executor runs
+    them through this function and replays the events in the server process.
+    """
+    events = []
+    token = _captured_events.set(events)
+    try:
+        return func(*args, **kwargs), events
+    finally:
+        _captured_events.reset(token)
+
+
+def replay(events):
+    """Applies metric events returned by run_captured"""
+    for name, labels, value in events:
+        registry.apply(name, labels, value)
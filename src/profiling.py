@@ -0,0 +1,122 @@
+import contextvars
+import cProfile
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Load env. variables for profiling, disabled unless PROFILE_DIR is set
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "1.0"))
+PROFILE_TRACEMALLOC_TOP = int(os.environ.get("PROFILE_TRACEMALLOC_TOP", "20"))
+
+if PROFILE_DIR:
+    logger.info(f"Profiling {PROFILE_SAMPLE_RATE:.0%} of requests into {PROFILE_DIR}")
+
+# Spans of the request being profiled, None when the request is not sampled
+_request_spans = contextvars.ContextVar("profiled_request_spans", default=None)
+
+# Numbers the profiles written by this process
+_profile_counter = itertools.count(1)
+
+# tracemalloc traces the whole process, so only one request at a time uses it
+_tracemalloc_lock = threading.Lock()
+
+
+@contextmanager
+def span(tool, name, metric=True):
+    """Measures a phase of creating a document.
+
+    Phases with metric=True (template, parse, build, assemble, serialize, upload) are reported to
+    the documents_phase_seconds metric. All spans are listed in the report of a profiled
+    request, so finer spans (e.g. one table) use metric=False.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if metric:
+            metrics.observe("documents_phase_seconds", elapsed, tool=tool, phase=name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((f"{tool}.{name}", elapsed))
+
+
+def format_report(label, elapsed, spans, snapshot, peak):
+    """Returns text report of a profiled request"""
+    lines = [f"{label}: {elapsed * 1000:.1f} ms", "", "Spans (count, total ms):"]
+
+    totals = {}
+    for name, seconds in spans:
+        count, total = totals.get(name, (0, 0.0))
+        totals[name] = (count + 1, total + seconds)
+    for name, (count, total) in totals.items():
+        lines.append(f"  {name:<24} {count:>6} {total * 1000:>10.1f}")
+
+    if snapshot is not None:
+        lines += ["", f"Peak traced memory: {peak / 1024:.1f} KB", f"Top {PROFILE_TRACEMALLOC_TOP} allocations:"]
+        for stat in snapshot.statistics("lineno")[:PROFILE_TRACEMALLOC_TOP]:
+            lines.append(f"  {stat}")
+
+    return "\n".join(lines) + "\n"
+
+
+def profiled(label, func, *args, **kwargs):
+    """Runs func, for sampled requests with cProfile and tracemalloc.
+
+    Writes <label>_<time>_<pid>_<n>.prof (open e.g. with snakeviz) and a .txt report with
+    spans and top allocations to PROFILE_DIR. Without PROFILE_DIR, func is just called.
+    """
+    if not PROFILE_DIR or random.random() >= PROFILE_SAMPLE_RATE:
+        return func(*args, **kwargs)
+
+    spans = []
+    token = _request_spans.set(spans)
+    profiler = cProfile.Profile()
+    trace_memory = (PROFILE_TRACEMALLOC_TOP > 0 and not tracemalloc.is_tracing()
+                    and _tracemalloc_lock.acquire(blocking=False))
+    snapshot = None
+    peak = 0
+
+    try:
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active in this thread
+            profiler = None
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+            if trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                base = os.path.join(PROFILE_DIR, f"{label}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{next(_profile_counter)}")
+                if profiler is not None:
+                    profiler.dump_stats(f"{base}.prof")
+                with open(f"{base}.txt", "w") as report:
+                    report.write(format_report(label, elapsed, spans, snapshot, peak))
+            except OSError as e:
+                logger.error(f"Failed to write profile of {label}: {e}")
+    finally:
+        if trace_memory:
+            _tracemalloc_lock.release()
+        _request_spans.reset(token)
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Load env. variables for the result cache
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", "3000"))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def make_cache_key(tool, arguments, template_fingerprint=""):
+    """Returns hash of the tool name, normalized arguments and template version"""
+    normalized = json.dumps(arguments, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    digest = hashlib.sha256()
+    for part in (tool, normalized, template_fingerprint):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Remembers uploaded documents so identical requests are not built again.
+
+    Maps cache key to the name of the already uploaded object and its size. Entries
+    expire after ttl seconds, the least recently used ones are evicted when there are
+    more than max_entries entries or their total size exceeds max_bytes.
+    """
+
+    def __init__(self, enabled=RESULT_CACHE_ENABLED, ttl=RESULT_CACHE_TTL,
+                 max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns object name for the key or None if not cached"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                metrics.inc("result_cache_requests_total", result="miss")
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.inc("result_cache_requests_total", result="hit")
+            return entry[0]
+
+    def put(self, key, object_name, size):
+        """Stores object name and size of the uploaded document under the key"""
+        if not self.enabled or size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (object_name, size, time.monotonic())
+            self._total_bytes += size
+
+            # Evict least recently used entries
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        """Drops the entry, e.g. when the uploaded object no longer exists"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def stats(self):
+        """Returns hit/miss counters and current size of the cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+
+result_cache = ResultCache()
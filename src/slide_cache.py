@@ -0,0 +1,81 @@
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Load env. variables for the slide cache
+SLIDE_CACHE_ENABLED = os.environ.get("SLIDE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SLIDE_CACHE_MAX_ENTRIES = int(os.environ.get("SLIDE_CACHE_MAX_ENTRIES", "512"))
+
+
+class SlideCache:
+    """Remembers the shape trees of built slides so repeated slides are not built again.
+
+    Maps (template fingerprint, slide type, normalized content) to a detached copy of the
+    slide's p:spTree element. Decks sharing boilerplate slides (title, agenda, disclaimer)
+    clone the cached shape tree instead of filling the placeholders again. The least
+    recently used entries are evicted when there are more than max_entries entries.
+
+    Every build worker process has its own cache.
+    """
+
+    def __init__(self, enabled=SLIDE_CACHE_ENABLED, max_entries=SLIDE_CACHE_MAX_ENTRIES):
+        self.enabled = enabled and max_entries > 0
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, slide_type):
+        """Returns a copy of the cached shape tree for the key or None if not cached"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            spTree = self._entries.get(key)
+            if spTree is None:
+                self.misses += 1
+                metrics.inc("slide_cache_requests_total", slide_type=slide_type, result="miss")
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.inc("slide_cache_requests_total", slide_type=slide_type, result="hit")
+            return copy.deepcopy(spTree)
+
+    def put(self, key, spTree):
+        """Stores a copy of the shape tree of a built slide under the key"""
+        if not self.enabled:
+            return
+
+        spTree = copy.deepcopy(spTree)
+        with self._lock:
+            self._entries[key] = spTree
+            self._entries.move_to_end(key)
+
+            # Evict least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drops all cached slides"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns hit/miss counters and current size of the cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+
+slide_cache = SlideCache()
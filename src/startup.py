@@ -0,0 +1,125 @@
+import importlib
+import logging
+import os
+import threading
+import time
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Load env. variables for the startup warm-up
+STARTUP_PRELOAD = os.environ.get("STARTUP_PRELOAD", "true").lower() in ("1", "true", "yes")
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
+
+def import_modules(modules):
+    """Imports modules in the given order and returns import time of each in seconds.
+
+    Modules already imported take no time, so list dependencies before the modules using
+    them to get the time of each dependency on its own (like python -X importtime).
+    """
+    timings = {}
+    for module in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.error(f"Failed to import {module}: {e}")
+            continue
+        timings[module] = time.perf_counter() - start
+    return timings
+
+
+class Startup:
+    """Tracks startup phases of the server and whether it is ready for traffic.
+
+    The server accepts connections as soon as its own modules are imported, the document
+    builders and their dependencies are imported (and with STARTUP_WARMUP a tiny document
+    of each type is built) by a background warm-up afterwards. The server is ready once
+    the warm-up has finished.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.timings = {}
+        self.warm_up_seconds = None
+        self._ready = threading.Event()
+        self._warm_up_started = False
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        """Records the end of a startup phase, in seconds since start"""
+        self.phases.setdefault(phase, time.perf_counter() - self.started)
+
+    def reset(self):
+        """Starts measuring the startup again, e.g. in a newly forked server worker"""
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        """Waits until the warm-up has finished, returns True if ready"""
+        return self._ready.wait(timeout)
+
+    def start_warm_up(self, warm_up):
+        """Runs warm_up in a background thread, once per process.
+
+        :param warm_up: Function returning time of each warm-up step (import, build) in seconds
+        """
+        with self._lock:
+            if self._warm_up_started:
+                return
+            self._warm_up_started = True
+
+        if not STARTUP_PRELOAD:
+            self._set_ready()
+            return
+
+        threading.Thread(target=self._run_warm_up, args=(warm_up,), name="warm-up", daemon=True).start()
+
+    def _run_warm_up(self, warm_up):
+        start = time.perf_counter()
+        try:
+            self.timings.update(warm_up())
+        except Exception as e:
+            logger.error(f"Warm-up failed: {e}")
+        finally:
+            self.warm_up_seconds = time.perf_counter() - start
+            self._set_ready()
+            print(self.report())
+
+    def _set_ready(self):
+        self.mark("ready")
+        self._ready.set()
+
+    def report(self):
+        """Returns startup phases and time of each warm-up step, slowest first"""
+        line = "Startup: " + ", ".join(f"{phase} after {seconds:.2f} s" for phase, seconds in self.phases.items())
+        if self.warm_up_seconds is not None:
+            line += f" (warm-up {self.warm_up_seconds:.2f} s)"
+        lines = [line]
+        for step, seconds in sorted(self.timings.items(), key=lambda item: item[1], reverse=True):
+            lines.append(f"  {seconds * 1000:8.1f} ms | {step}")
+        return "\n".join(lines)
+
+
+startup = Startup()
+
+
+def collect_startup_metrics():
+    """Returns startup phases and readiness for the metrics endpoint"""
+    return [
+        ("startup_phase_seconds", "Seconds from start to the end of each startup phase", "gauge",
+         [({"phase": phase}, seconds) for phase, seconds in startup.phases.items()]),
+        ("startup_warm_up_seconds", "Duration of the warm-up", "gauge",
+         [({}, startup.warm_up_seconds)] if startup.warm_up_seconds is not None else []),
+        ("startup_ready", "1 once the warm-up has finished", "gauge",
+         [({}, 1 if startup.ready else 0)]),
+    ]
+
+
+registry.add_collector(collect_startup_metrics)
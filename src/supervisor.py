@@ -0,0 +1,341 @@
+import asyncio
+import multiprocessing
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from startup import startup
+import metrics
+
+# Load env. variables for the multi-worker server mode
+WEB_WORKERS = max(1, int(os.environ.get("WEB_WORKERS", "1")))
+WEB_WORKER_MAX_REQUESTS = int(os.environ.get("WEB_WORKER_MAX_REQUESTS", "0"))
+WEB_WORKER_MAX_REQUESTS_JITTER = int(os.environ.get("WEB_WORKER_MAX_REQUESTS_JITTER", "0"))
+WEB_GRACEFUL_TIMEOUT = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", "10"))
+WEB_WORKER_READY_TIMEOUT = int(os.environ.get("WEB_WORKER_READY_TIMEOUT", "120"))
+# Seconds a worker keeps serving after its last keep-alive request, uvicorn closes idle connections after 5 s
+WEB_WORKER_DRAIN_TIMEOUT = float(os.environ.get("WEB_WORKER_DRAIN_TIMEOUT", "5"))
+
+
+# Shared with the forked workers, set by the master while all workers are ready
+_all_ready = None
+
+
+def all_workers_ready():
+    """Returns False while a server worker is warming up in multi-worker mode, else True"""
+    return _all_ready is None or bool(_all_ready.value)
+
+
+def exit_on_signal(signum, frame):
+    """Signal handler turning SIGTERM into SystemExit.
+
+    uvicorn shuts down gracefully on SIGTERM and then raises the signal again. With the
+    default handler the process would die right away, before the server lifespan has
+    stopped the build pool, leaving its worker processes behind.
+    """
+    sys.exit(0)
+
+
+class WorkerRecycler:
+    """ASGI middleware stopping the worker after a number of requests, to be replaced by the master.
+
+    Closing the keep-alive connections right away (as uvicorn's limit_max_requests does)
+    fails requests clients have just sent on them. Once the limit is reached, responses
+    ask clients to close the connection instead, and the worker stops gracefully after
+    drain_timeout seconds, when the connections are closed or idle.
+    """
+
+    def __init__(self, app, max_requests=WEB_WORKER_MAX_REQUESTS, jitter=WEB_WORKER_MAX_REQUESTS_JITTER,
+                 drain_timeout=WEB_WORKER_DRAIN_TIMEOUT):
+        self.app = app
+        # Workers started together are not replaced at the same time
+        self.max_requests = max_requests + random.randint(0, max(0, jitter))
+        self.drain_timeout = drain_timeout
+        self.requests = 0
+        self.draining = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        self.requests += 1
+        if not self.draining and self.requests >= self.max_requests:
+            self.draining = True
+            print(f"Worker {os.getpid()} served {self.requests} requests, stopping in {self.drain_timeout} s")
+            # Graceful shutdown as on SIGTERM from the master
+            asyncio.get_running_loop().call_later(self.drain_timeout, os.kill, os.getpid(), signal.SIGTERM)
+        if not self.draining:
+            return await self.app(scope, receive, send)
+
+        async def send_closing(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=[*message.get("headers", []), (b"connection", b"close")])
+            await send(message)
+
+        await self.app(scope, receive, send_closing)
+
+
+def notify_ready(write_fd):
+    """Tells the master through the pipe that this worker has finished its warm-up"""
+    startup.wait_ready()
+    try:
+        os.write(write_fd, b"1")
+    except OSError:
+        pass
+    finally:
+        os.close(write_fd)
+
+
+class Supervisor:
+    """Runs the server in several pre-forked worker processes sharing one listening socket.
+
+    The master binds the socket and forks the workers, each worker runs serve(sock) with
+    its own event loop, build pool and caches. The master only watches the workers:
+
+    - a worker that exits (e.g. after WEB_WORKER_MAX_REQUESTS requests) is replaced
+    - SIGHUP replaces the workers one at a time, an old worker is stopped only once its
+      replacement has finished the warm-up, so the capacity never drops
+    - SIGTERM and SIGINT stop all workers gracefully, workers still running after
+      graceful_timeout seconds are killed
+
+    Each worker reports through a pipe when it has finished its warm-up. The workers are
+    ready (see all_workers_ready) while the number of ready workers is at least the
+    configured one, e.g. not before all have started and not while an exited worker is
+    being replaced. /metrics of any worker shows metrics of all workers (see SharedMetrics).
+    """
+
+    def __init__(self, serve, host, port, workers=WEB_WORKERS, graceful_timeout=WEB_GRACEFUL_TIMEOUT,
+                 ready_timeout=WEB_WORKER_READY_TIMEOUT):
+        self.serve = serve
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+
+        self.sock = None
+        self.shared_metrics = None
+        # pid: read end of the pipe the worker reports readiness through, None once read
+        self.workers = {}
+        # pid: worker id, unlike pids never reused
+        self.worker_ids = {}
+        self._next_worker_id = 0
+        # pids of workers which finished the warm-up
+        self.ready = set()
+        # pid: time after which a worker being stopped is killed
+        self.retiring = {}
+        self._stopping = False
+        self._reload = False
+
+    def run(self):
+        """Binds the socket, starts the workers and supervises them until SIGTERM or SIGINT"""
+        global _all_ready
+        self.sock = socket.create_server((self.host, self.port), backlog=2048)
+        # Both in memory shared with the workers forked afterwards
+        _all_ready = multiprocessing.RawValue("b", 0)
+        self.shared_metrics = metrics.share_between_workers()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        print(f"Starting {self.worker_count} server workers on http://{self.host}:{self.port} (master {os.getpid()})")
+        for _ in range(self.worker_count):
+            self.spawn()
+
+        try:
+            while not self._stopping:
+                self.reap()
+                self.kill_overdue()
+                if self._reload:
+                    self._reload = False
+                    self.rolling_restart()
+                self.replace_exited()
+                self.poll_ready(0.2)
+        finally:
+            self.stop()
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload = True
+
+    def spawn(self):
+        """Forks a new worker, returns its pid"""
+        read_fd, write_fd = os.pipe()
+        self._next_worker_id += 1
+        worker_id = self._next_worker_id
+        pid = os.fork()
+
+        if pid == 0:
+            # Worker process, never returns to the master loop
+            os.close(read_fd)
+            code = 0
+            try:
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                signal.signal(signal.SIGTERM, exit_on_signal)
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                startup.reset()
+                self.shared_metrics.start_worker(worker_id)
+                threading.Thread(target=notify_ready, args=(write_fd,), name="notify-ready", daemon=True).start()
+                self.serve(self.sock)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                try:
+                    self.shared_metrics.flush()
+                except Exception:
+                    traceback.print_exc()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        os.close(write_fd)
+        self.workers[pid] = read_fd
+        self.worker_ids[pid] = worker_id
+        self.update_ready()
+        return pid
+
+    def replace_exited(self):
+        """Starts new workers in place of those which exited"""
+        while not self._stopping and len(self.workers) - len(self.retiring) < self.worker_count:
+            self.spawn()
+
+    def reap(self):
+        """Collects exited workers"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            read_fd = self.workers.pop(pid, None)
+            if read_fd is not None:
+                os.close(read_fd)
+            self.ready.discard(pid)
+            worker_id = self.worker_ids.pop(pid, None)
+            if worker_id is not None:
+                self.shared_metrics.retire(worker_id)
+            retired = self.retiring.pop(pid, None) is not None
+            self.update_ready()
+            if retired or self._stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if code == 0:
+                print(f"Worker {pid} finished, starting a new one")
+            else:
+                print(f"Worker {pid} exited with code {code}, starting a new one")
+                # Do not restart a crashing worker in a tight loop
+                time.sleep(1)
+
+    def poll_ready(self, timeout):
+        """Waits up to timeout seconds for workers reporting the end of their warm-up"""
+        pipes = {read_fd: pid for pid, read_fd in self.workers.items() if read_fd is not None}
+        if not pipes:
+            time.sleep(timeout)
+            return
+
+        readable, _, _ = select.select(list(pipes), [], [], timeout)
+        for read_fd in readable:
+            pid = pipes[read_fd]
+            # Empty read means the worker exited before it was ready
+            if os.read(read_fd, 1) == b"1":
+                self.ready.add(pid)
+            os.close(read_fd)
+            self.workers[pid] = None
+        self.update_ready()
+
+    def update_ready(self):
+        """Shares with the workers whether enough workers are ready"""
+        ready = sum(1 for pid in self.workers if pid in self.ready and pid not in self.retiring)
+        _all_ready.value = ready >= self.worker_count
+
+    def kill_overdue(self):
+        """Kills workers which did not stop within the graceful timeout"""
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                print(f"Worker {pid} did not stop within {self.graceful_timeout} s, killing it")
+                self.retiring[pid] = float("inf")
+                self._signal(pid, signal.SIGKILL)
+
+    def retire(self, pid):
+        """Stops a worker gracefully, it finishes the requests it is serving"""
+        self.retiring[pid] = time.monotonic() + self.graceful_timeout
+        self.update_ready()
+        self._signal(pid, signal.SIGTERM)
+
+    def wait_ready(self, pid):
+        """Waits until the worker has finished its warm-up, returns False if it did not in time"""
+        deadline = time.monotonic() + self.ready_timeout
+        while not self._stopping and time.monotonic() < deadline:
+            if pid in self.ready:
+                return True
+            if pid not in self.workers:
+                return False
+            self.poll_ready(0.2)
+            self.reap()
+            self.replace_exited()
+        return False
+
+    def rolling_restart(self):
+        """Replaces the workers one at a time"""
+        print("Reloading server workers")
+        for pid in list(self.workers):
+            if self._stopping:
+                return
+            if pid in self.retiring or pid not in self.workers:
+                continue
+
+            new_pid = self.spawn()
+            if not self.wait_ready(new_pid):
+                print(f"Worker {new_pid} was not ready within {self.ready_timeout} s, reload stopped")
+                if new_pid in self.workers:
+                    self.retire(new_pid)
+                return
+            self.retire(pid)
+        print("Server workers reloaded")
+
+    def stop(self):
+        """Stops all workers gracefully, kills those still running after the graceful timeout"""
+        print("Stopping server workers")
+        self._stopping = True
+        for pid in self.workers:
+            self._signal(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            read_fd = self.workers.pop(pid)
+            if read_fd is not None:
+                os.close(read_fd)
+
+        if self.sock is not None:
+            self.sock.close()
+        if self.shared_metrics is not None:
+            self.shared_metrics.close()
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
@@ -0,0 +1,129 @@
+import copy
+import logging
+import os
+import threading
+from pathlib import Path
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Directory with custom templates, takes precedence over the bundled ones
+CUSTOM_TEMPLATES_DIR = Path(os.environ.get("CUSTOM_TEMPLATES_DIR", "/app/templates"))
+BUNDLED_TEMPLATES_DIR = Path(__file__).parent
+
+# Template kind: (custom file name, bundled file name)
+TEMPLATE_FILES = {
+    "pptx_4_3": ("template_4_3.pptx", "template_general_4_3.pptx"),
+    "pptx_16_9": ("template_16_9.pptx", "template_general_16_9.pptx"),
+    "docx": ("template.docx", "template.docx"),
+}
+
+
+def load_pptx_template(path):
+    """Parses presentation template and removes its default slide"""
+    from pptx import Presentation
+
+    presentation = Presentation(path)
+
+    # Remove default slide if it exists. Works on the XML directly, because python-pptx
+    # caches proxies such as presentation.slides, and a deep copy of a cached proxy
+    # would point to a detached copy of the element instead of the copied tree.
+    sldIdLst = presentation.part._element.sldIdLst
+    if sldIdLst is not None and len(sldIdLst) > 0:
+        sldIdLst.remove(sldIdLst[0])
+
+    return presentation
+
+
+def load_docx_template(path):
+    """Parses Word template"""
+    from docx import Document
+
+    return Document(path)
+
+
+TEMPLATE_LOADERS = {
+    "pptx_4_3": load_pptx_template,
+    "pptx_16_9": load_pptx_template,
+    "docx": load_docx_template,
+}
+
+
+class TemplateCache:
+    """Keeps each template parsed once in memory and hands out copies of it.
+
+    Templates are looked up in CUSTOM_TEMPLATES_DIR first and then next to the source
+    code. A cached template is reloaded when the file path, modification time or size
+    changes. If no template file exists, the library default template is cached.
+
+    The pristine templates are only ever deep-copied, never modified or accessed
+    through python-pptx/python-docx properties.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve_path(self, kind):
+        """Returns path to the template file of given kind or None if not found"""
+        custom_name, bundled_name = TEMPLATE_FILES[kind]
+        for path in (CUSTOM_TEMPLATES_DIR / custom_name, BUNDLED_TEMPLATES_DIR / bundled_name):
+            if path.exists():
+                return path
+        return None
+
+    def _file_signature(self, path):
+        """Returns identification of the template file version"""
+        if path is None:
+            return None
+        stat = path.stat()
+        return str(path), stat.st_mtime_ns, stat.st_size
+
+    def _get_entry(self, kind):
+        """Returns (signature, pristine template), parsing the template if needed"""
+        path = self.resolve_path(kind)
+        signature = self._file_signature(path)
+
+        with self._lock:
+            entry = self._entries.get(kind)
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                metrics.inc("template_cache_requests_total", kind=kind, result="hit")
+                return entry
+
+            self.misses += 1
+            metrics.inc("template_cache_requests_total", kind=kind, result="miss")
+            if path is None:
+                logger.warning(f"Template {kind} not found, will use default template")
+            else:
+                logger.info(f"Loading template {kind} from {path}")
+
+            entry = (signature, TEMPLATE_LOADERS[kind](str(path) if path else None))
+            self._entries[kind] = entry
+            return entry
+
+    def get(self, kind):
+        """Returns a fresh copy of the template of given kind, ready to be filled"""
+        _, pristine = self._get_entry(kind)
+        return copy.deepcopy(pristine)
+
+    def fingerprint(self, kind):
+        """Returns a string identifying the current version of the template.
+
+        Only the template file is checked, the template is not parsed.
+        """
+        signature = self._file_signature(self.resolve_path(kind))
+        if signature is None:
+            return f"{kind}:default"
+        path, mtime, size = signature
+        return f"{kind}:{path}:{mtime}:{size}"
+
+    def clear(self):
+        """Drops all cached templates"""
+        with self._lock:
+            self._entries.clear()
+
+
+template_cache = TemplateCache()
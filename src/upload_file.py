@@ -1,7 +1,11 @@
-import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
+from executor import executor
+from profiling import span, profiled
 import uuid
 import os
+import shutil
+import threading
+import asyncio
+import time
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,6 +15,8 @@ UPLOAD_STRATEGY = os.environ.get("UPLOAD_STRATEGY", "LOCAL")
 
 # Checks value of env. variable
 if UPLOAD_STRATEGY == "LOCAL":
+    LOCAL_OUTPUT_DIR = os.environ.get("LOCAL_OUTPUT_DIR", "/app/output")
+    LOCAL_CHUNK_SIZE = int(os.environ.get("LOCAL_CHUNK_SIZE", str(1024 * 1024)))
     logger.info("Local upload strategy set.")
 
 # Loads required env. variables for S3 upload strategy
@@ -19,6 +25,17 @@ elif UPLOAD_STRATEGY == "S3":
     AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
     AWS_REGION = os.environ.get('AWS_REGION')
     S3_BUCKET = os.environ.get("S3_BUCKET")
+    # Optional, e.g. a local MinIO or moto server
+    S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or f'https://s3.{AWS_REGION}.amazonaws.com'
+    S3_ADDRESSING_STYLE = os.environ.get("S3_ADDRESSING_STYLE", "auto")
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "10"))
+    # Multipart upload settings
+    S3_MULTIPART_THRESHOLD = int(os.environ.get("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+    S3_MULTIPART_CHUNKSIZE = int(os.environ.get("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+    S3_MAX_CONCURRENCY = int(os.environ.get("S3_MAX_CONCURRENCY", "4"))
+    # Readiness check of the bucket, its result is reused for S3_HEALTH_CHECK_TTL seconds
+    S3_HEALTH_CHECK_TTL = float(os.environ.get("S3_HEALTH_CHECK_TTL", "10"))
+    S3_HEALTH_CHECK_TIMEOUT = float(os.environ.get("S3_HEALTH_CHECK_TIMEOUT", "2"))
     if not AWS_REGION:
         logger.error("Missing AWS_REGION env. variable")
     elif not AWS_ACCESS_KEY:
@@ -33,6 +50,93 @@ elif UPLOAD_STRATEGY == "S3":
 else:
     logger.error("Invalid upload strategy, set either to LOCAL or S3")
 
+# Process-wide S3 client, created lazily on first use
+_s3_client = None
+_s3_client_pid = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    """Return the shared S3 client, creating it on first use.
+
+    boto3 clients are thread-safe, so one client with a pool of keep-alive connections
+    serves all upload threads. A new client is created after fork, as connections
+    cannot be shared between processes.
+
+    :return: boto3 S3 client
+    """
+
+    global _s3_client, _s3_client_pid
+
+    if _s3_client is None or _s3_client_pid != os.getpid():
+        with _s3_client_lock:
+            if _s3_client is None or _s3_client_pid != os.getpid():
+                # Imported on first use, boto3 is slow to import and not needed for LOCAL
+                import boto3
+                from botocore.config import Config
+
+                config = Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    s3={'addressing_style': S3_ADDRESSING_STYLE}
+                )
+                _s3_client = boto3.session.Session().client(
+                    's3', region_name=AWS_REGION, aws_access_key_id=AWS_ACCESS_KEY,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY, endpoint_url=S3_ENDPOINT_URL, config=config)
+                _s3_client_pid = os.getpid()
+                logger.info(f"Created S3 client for {S3_ENDPOINT_URL} with {S3_MAX_POOL_CONNECTIONS} pooled connections")
+
+    return _s3_client
+
+def reset_s3_client():
+    """Drop the shared S3 client, next upload creates a new one"""
+
+    global _s3_client, _s3_client_pid
+
+    with _s3_client_lock:
+        _s3_client = None
+        _s3_client_pid = None
+
+def s3_health_check():
+    """Check that the S3 bucket is reachable with the shared client.
+
+    :return: True if the bucket is reachable, else False
+    """
+
+    try:
+        get_s3_client().head_bucket(Bucket=S3_BUCKET)
+        return True
+    except Exception as e:
+        logger.error(f"S3 health check failed: {e}")
+        reset_s3_client()
+        return False
+
+# Last result of the S3 health check and when it was taken
+_s3_health = (None, 0.0)
+_s3_health_lock = asyncio.Lock()
+
+async def s3_ready():
+    """Check that the S3 bucket is reachable, for the readiness endpoint.
+
+    The check runs on the upload pool and its result is cached for S3_HEALTH_CHECK_TTL
+    seconds, so frequent probes do not hit the bucket. A check that takes longer than
+    S3_HEALTH_CHECK_TIMEOUT seconds counts as failed.
+
+    :return: True if the bucket is reachable, else False
+    """
+
+    global _s3_health
+
+    async with _s3_health_lock:
+        result, checked_at = _s3_health
+        if result is None or time.monotonic() - checked_at >= S3_HEALTH_CHECK_TTL:
+            try:
+                result = await asyncio.wait_for(executor.run_upload(s3_health_check), S3_HEALTH_CHECK_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.error(f"S3 health check timed out after {S3_HEALTH_CHECK_TIMEOUT} s")
+                result = False
+            _s3_health = (result, time.monotonic())
+    return result
+
 def generate_unique_object_name(suffix):
     """Generate a unique object name using UUID and preserve the file extension.
 
@@ -46,68 +150,176 @@ def generate_unique_object_name(suffix):
 
     return unique_object_name
 
-def upload_file(file_object, suffix):
-    """Upload a file to an S3 bucket and return a pre-signed URL valid for 1 hour.
+CONTENT_TYPES = {
+    "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "eml": "application/octet-stream",
+    "zip": "application/zip",
+    "mbox": "application/mbox",
+}
 
-    :param file_object: File-like object to upload
-    :return: Pre-signed URL string if successful, else None
+def get_suffix(file_name):
+    """Return file extension of the file name"""
+    return file_name.rsplit(".", 1)[-1]
+
+def get_content_type(file_name):
+    """Return content type based on the file extension"""
+    suffix = get_suffix(file_name)
+    if suffix not in CONTENT_TYPES:
+        raise ValueError("Unknown file type")
+    return CONTENT_TYPES[suffix]
+
+
+class UploadBackend:
+    """Base class of upload backends.
+
+    Subclasses implement the blocking upload, upload_async runs it on the upload
+    thread pool so the event loop is not blocked.
     """
 
-    object_name = generate_unique_object_name(suffix)
+    def upload(self, file_object, object_name):
+        """Upload file-like object under given name and return message for the user"""
+        raise NotImplementedError
 
-    if UPLOAD_STRATEGY == "LOCAL":
-        return upload_to_local_folder(file_object, object_name)
-    elif UPLOAD_STRATEGY == "S3":
-        return upload_to_s3(file_object, object_name)
-    else:
-        return "No upload strategy set, presentation cannot be created."
+    def link(self, object_name):
+        """Return message for the user for already uploaded object, None if it no longer exists"""
+        raise NotImplementedError
 
-def upload_to_s3(file_object, file_name):
+    async def upload_async(self, file_object, object_name):
+        """Upload file-like object without blocking the event loop"""
+        return await executor.run_upload(profiled, "upload", self.upload, file_object, object_name)
 
-    # Create an S3 client
-    s3_client = boto3.client('s3', region_name=AWS_REGION, aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY, endpoint_url=f'https://s3.{AWS_REGION}.amazonaws.com')
+    async def link_async(self, object_name):
+        """Return message for already uploaded object without blocking the event loop"""
+        return await executor.run_upload(self.link, object_name)
 
-    if "pptx" in file_name:
-        content_type = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
-    elif "docx" in file_name:
-        content_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    elif "xlsx" in file_name:
-        content_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    elif "eml" in file_name:
-        content_type = "application/octet-stream"
-    else:
-        raise ValueError("Unknown file type")
 
-    try:
-        # Upload the file to S3
-        s3_client.upload_fileobj(Fileobj=file_object, Bucket=S3_BUCKET, Key=file_name, ExtraArgs={'ContentType': content_type})
+class LocalUploadBackend(UploadBackend):
+    """Saves documents to a local folder (mounted to the host)"""
+
+    def __init__(self, output_dir=None, chunk_size=None):
+        self.output_dir = output_dir or LOCAL_OUTPUT_DIR
+        self.chunk_size = chunk_size or LOCAL_CHUNK_SIZE
+
+    def upload(self, file_object, object_name):
+        save_path = os.path.join(self.output_dir, object_name)
+        temp_path = os.path.join(self.output_dir, f".{object_name}.part")
+
+        # Stream in chunks to a temporary file, then rename it so that a partially
+        # written document is never visible in the output folder
+        try:
+            with span(get_suffix(object_name), "upload"):
+                with open(temp_path, 'wb') as f:
+                    shutil.copyfileobj(file_object, f, self.chunk_size)
+                os.replace(temp_path, save_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return self.link(object_name)
+
+    def link(self, object_name):
+        if not os.path.exists(os.path.join(self.output_dir, object_name)):
+            return None
+        return f"Inform user that the document {object_name} was saved to his output folder."
+
+
+class S3UploadBackend(UploadBackend):
+    """Uploads documents to S3 bucket and returns pre-signed URL valid for 1 hour"""
+
+    def __init__(self, bucket=None, transfer_config=None):
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket or S3_BUCKET
+        self.transfer_config = transfer_config or TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MAX_CONCURRENCY
+        )
+
+    def upload(self, file_object, object_name):
+        from botocore.exceptions import NoCredentialsError, ClientError
+
+        # Reuse the shared S3 client
+        s3_client = get_s3_client()
+        content_type = get_content_type(object_name)
+
+        try:
+            # Upload the file to S3, multipart for large documents
+            with span(get_suffix(object_name), "upload"):
+                s3_client.upload_fileobj(Fileobj=file_object, Bucket=self.bucket, Key=object_name,
+                                         ExtraArgs={'ContentType': content_type}, Config=self.transfer_config)
+
+            return self.link(object_name)
+
+        except FileNotFoundError:
+            print(f"The file {file_object} was not found.")
+            return None
+        except NoCredentialsError:
+            print("AWS credentials are not available.")
+            return None
+        except ClientError as e:
+            print(f"Client error: {e}")
+            return None
 
-        # Generate a pre-signed URL valid for 1 hour (3600 seconds)
-        url = s3_client.generate_presigned_url('get_object',
-                                               Params={'Bucket': S3_BUCKET,
-                                                       'Key': file_name},
-                                               ExpiresIn=3600)
+    def link(self, object_name):
+        from botocore.exceptions import NoCredentialsError, ClientError
+
+        try:
+            # Generate a pre-signed URL valid for 1 hour (3600 seconds)
+            with span(get_suffix(object_name), "presign", metric=False):
+                url = get_s3_client().generate_presigned_url('get_object',
+                                                             Params={'Bucket': self.bucket,
+                                                                     'Key': object_name},
+                                                             ExpiresIn=3600)
+        except (NoCredentialsError, ClientError) as e:
+            print(f"Client error: {e}")
+            return None
 
         return f"Link to created document to be shared with user in markdown format: {url} . Link is valid for 1 hour."
 
-    except FileNotFoundError:
-        print(f"The file {file_object} was not found.")
-        return None
-    except NoCredentialsError:
-        print("AWS credentials are not available.")
-        return None
-    except ClientError as e:
-        print(f"Client error: {e}")
-        return None
 
-def upload_to_local_folder(file_object, file_name):
+_upload_backend = None
+
+def get_upload_backend():
+    """Return upload backend for the configured upload strategy, None if not set"""
+
+    global _upload_backend
+
+    if _upload_backend is None:
+        if UPLOAD_STRATEGY == "LOCAL":
+            _upload_backend = LocalUploadBackend()
+        elif UPLOAD_STRATEGY == "S3":
+            _upload_backend = S3UploadBackend()
+
+    return _upload_backend
+
+def upload_file(file_object, suffix):
+    """Upload a file with the configured upload strategy.
+
+    :param file_object: File-like object to upload
+    :param suffix: File extension of the document
+    :return: Message with link to the document if successful, else None
+    """
+
+    backend = get_upload_backend()
+    if backend is None:
+        return "No upload strategy set, presentation cannot be created."
+
+    return backend.upload(file_object, generate_unique_object_name(suffix))
 
-    save_path = f'/app/output/{file_name}'
-    """ save_path = f'{file_name}'"""
+async def upload_file_async(file_object, suffix):
+    """Upload a file with the configured upload strategy without blocking the event loop.
 
-    with open(save_path, 'wb') as f:
-        f.write(file_object.read())
+    :param file_object: File-like object to upload
+    :param suffix: File extension of the document
+    :return: Message with link to the document if successful, else None
+    """
 
+    backend = get_upload_backend()
+    if backend is None:
+        return "No upload strategy set, presentation cannot be created."
 
-    return f"Inform user that the document {file_name} was saved to his output folder."
\ No newline at end of file
+    return await backend.upload_async(file_object, generate_unique_object_name(suffix))